@@ -56,45 +56,42 @@ $(function () {
         window.location.href = url.toString();
     });
 
-    $("table tr input[type=checkbox]").on("change", () => {
-        updateTotalQuantity();
-        var checklist_obj = construct_checklist();
+    // delegated, rows appended by the product feed are handled as well
+    $("table tbody").on("change", "input[type=checkbox]", function () {
+        var checklist_obj = construct_checklist($(this));
         $.ajax({
             type: "POST",
             url: data.updateChecklistUrl,
             data: JSON.stringify(checklist_obj),
             dataTyle: "json",
             contentType: "application/json",
+            success: function () {
+                updateTotalQuantity();
+            },
         });
     });
 
-    function construct_checklist() {
-        var checklist = [];
-        var unchecklist = [];
-        $("table tr input[type=checkbox]").each(function () {
-            var prod_no = parseInt($(this).parent().parent().attr("data-id"));
-            var order_quantity = parseInt(
-                $(this)
-                    .parent()
-                    .parent()
-                    .find("input[field=order-quantity]")
-                    .val()
-            );
-            var prod = {
-                prod_no: prod_no,
-                order_quantity: order_quantity,
-            };
-            if ($(this).prop("checked")) checklist.push(prod);
-            else unchecklist.push(prod);
-        });
+    /**
+     * Build the checklist change of a single checkbox, only the changed
+     * product is sent.
+     *
+     * @param {jQuery} checkbox
+     */
+    function construct_checklist(checkbox) {
+        var tr = checkbox.parent().parent();
+        var prod = {
+            prod_no: parseInt(tr.attr("data-id")),
+            order_quantity: parseInt(tr.find("input[field=order-quantity]").val()),
+        };
+        var checked = checkbox.prop("checked");
         return {
-            mfr_full_id: "manufacturerId" in data ? data.manufacturerId : null,
-            checklist: checklist,
-            unchecklist: unchecklist,
+            mfr_full_id: tr.attr("data-mfr-full-id"),
+            checklist: checked ? [prod] : [],
+            unchecklist: checked ? [] : [prod],
         };
     }
 
-    $("table tr input[field=order-quantity]").on("change", function () {
+    $("table tbody").on("change", "input[field=order-quantity]", function () {
         // TODO: when change order box quantity, update order quantity
         var tr = $(this).parent().parent();
         tr.find("input[type=checkbox]")
@@ -133,52 +130,75 @@ $(function () {
         order_box_quantity_field.val(box_quantity.toFixed(2));
 
         total_quantity_field.val(order_quantity + prod_quantity);
-        updateTotalQuantity();
     });
 
+    /**
+     * Refresh the footer totals, they are summed by the server over every
+     * product of the manufacturer, not only the rows of this page.
+     */
     function updateTotalQuantity() {
-        var sum_of_box_quantity_field = $("input[field=co_order_box_quantity]");
-        var sum_of_order_cost_price_field = $(
-            "input[field=co_order_cost_price]"
-        );
-        var target_tr = $("input[field=order-box-quantity]")
-            .parent()
-            .parent()
-            .filter((idx, el) => {
-                return (
-                    $(el).find("input[type=checkbox]").prop("checked") == true
+        if (!("manufacturerId" in data)) return;
+        $.ajax({
+            type: "GET",
+            url: data.checklistTotalsUrl,
+            data: { mfr_full_id: data.manufacturerId },
+            dataType: "json",
+            success: function (totals) {
+                $("input[field=co_order_box_quantity]").val(
+                    totals.order_box_quantity
                 );
-            });
-        var box_quantity_arr = target_tr
-            .find("input[field=order-box-quantity]")
-            .map(function () {
-                return parseFloat($(this).val());
-            })
-            .get();
-
-        var sum_of_box_quantity =
-            box_quantity_arr.length == 0
-                ? 0
-                : box_quantity_arr.reduce(function (acc, curr) {
-                      return acc + curr;
-                  });
-
-        var order_cost_price_arr = target_tr
-            .find("input[field=order-cost-price]")
-            .map(function () {
-                return parseFloat($(this).val());
-            })
-            .get();
+                $("input[field=co_order_cost_price]").val(
+                    totals.order_cost_price
+                );
+                $("input[field=co_total_quantity]").val(totals.total_quantity);
+            },
+        });
+    }
 
-        var sum_of_order_cost_price =
-            order_cost_price_arr.length == 0
-                ? 0
-                : order_cost_price_arr.reduce(function (acc, curr) {
-                      return acc + curr;
-                  });
+    /**
+     * Append the next page of the product feed, every manufacturer of the
+     * buyer is listed in one table that grows as it is scrolled.
+     */
+    var loading_products = false;
+    function load_more_products(observer) {
+        if (loading_products) return;
+        if (!data.nextCursor) {
+            observer.disconnect();
+            return;
+        }
+        loading_products = true;
+        $.ajax({
+            type: "GET",
+            url: data.productsFeedUrl,
+            data: data.mfrUserId
+                ? { cursor: data.nextCursor, mfr_user_id: data.mfrUserId }
+                : { cursor: data.nextCursor },
+            dataType: "json",
+            success: function (page) {
+                $("table tbody").append(page.html);
+                data.nextCursor = page.next_cursor || "";
+                // observing again reports the sentinel if it is still visible
+                observer.unobserve(sentinel);
+                observer.observe(sentinel);
+            },
+            error: function () {
+                alert_div_set("error", "伺服器錯誤，請稍後再試！");
+                observer.disconnect();
+            },
+            complete: function () {
+                loading_products = false;
+            },
+        });
+    }
 
-        sum_of_box_quantity_field.val(sum_of_box_quantity);
-        sum_of_order_cost_price_field.val(sum_of_order_cost_price);
+    var sentinel = document.querySelector("div[field=stream-sentinel]");
+    if ("productsFeedUrl" in data && sentinel) {
+        var observer = new IntersectionObserver(function (entries) {
+            if (entries.some((entry) => entry.isIntersecting)) {
+                load_more_products(observer);
+            }
+        });
+        observer.observe(sentinel);
     }
 
     function get_checked_products() {
@@ -205,6 +225,20 @@ $(function () {
         return { action: action, products: order_products };
     }
 
+    function show_product_error(error) {
+        product_feedbacks_set("show");
+        var target_tr = $(`tr[data-id=${error.obj}]`);
+        var invalid_input = target_tr.find("input[field=order-quantity]");
+        var feedback = target_tr.find("div[field=feedback]");
+        feedback.addClass("alert alert-danger");
+        if (feedback.children().length > 0) {
+            feedback.children().append(`<li>${error.message}</li>`);
+        } else {
+            feedback.append(`<ul><li>${error.message}</li></ul>`);
+        }
+        invalid_input.removeClass("is-valid").addClass("is-invalid");
+    }
+
     function handle_order_error(err) {
         if (err.status == 400) {
             var errors = err.responseJSON.errors;
@@ -217,19 +251,7 @@ $(function () {
                     global_errors.push(error.message);
                     continue;
                 }
-                product_feedbacks_set("show");
-                var target_tr = $(`tr[data-id=${error.obj}]`);
-                var invalid_input = target_tr.find(
-                    "input[field=order-quantity]"
-                );
-                var feedback = target_tr.find("div[field=feedback]");
-                feedback.addClass("alert alert-danger");
-                if (feedback.children().length > 0) {
-                    feedback.children().append(`<li>${error.message}</li>`);
-                } else {
-                    feedback.append(`<ul><li>${error.message}</li></ul>`);
-                }
-                invalid_input.removeClass("is-valid").addClass("is-invalid");
+                show_product_error(error);
             }
             if (errors.length > 0) {
                 get_checked_products()
@@ -245,6 +267,57 @@ $(function () {
         }
     }
 
+    async function stream_validation(products) {
+        // each line of the response is the result of one product or group
+        var response = await fetch(data.validateOrderUrl, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ products: products }),
+        });
+        if (!response.ok) {
+            alert_div_set("error", "伺服器錯誤，請稍後再試！");
+            return;
+        }
+        var reader = response.body
+            .pipeThrough(new TextDecoderStream())
+            .getReader();
+        var buffer = "";
+        var error_count = 0;
+        var global_errors = [];
+        while (true) {
+            var { value, done } = await reader.read();
+            if (done) break;
+            buffer += value;
+            var lines = buffer.split("\n");
+            buffer = lines.pop();
+            for (let line of lines) {
+                if (line.length == 0) continue;
+                var record = JSON.parse(line);
+                error_count += record.errors.length;
+                if (record.type == "group") {
+                    for (let error of record.errors) {
+                        global_errors.push(error.message);
+                    }
+                    if (global_errors.length > 0) {
+                        alert_div_set("error", global_errors);
+                    }
+                    continue;
+                }
+                for (let error of record.errors) {
+                    show_product_error(error);
+                }
+            }
+        }
+        if (error_count == 0) {
+            alert_div_set("success", "訂單驗證成功");
+        } else {
+            get_checked_products()
+                .find("input[field=order-quantity].is-invalid")
+                .first()
+                .trigger("focus");
+        }
+    }
+
     function reset_feedbacks() {
         $("div[field=feedback]").children().remove();
         alert_div_set("hidden");
@@ -256,24 +329,12 @@ $(function () {
     $("input[field=btn-validation]").on("click", () => {
         var order_obj = constructOrder("validation");
         if (order_obj.products == 0) return;
-        $.ajax({
-            type: "POST",
-            url: data.createOrderUrl,
-            data: JSON.stringify(order_obj),
-            dataTyle: "json",
-            contentType: "application/json",
-            beforeSend: function () {
-                reset_feedbacks();
-                get_checked_products()
-                    .find("input[field=order-quantity]")
-                    .addClass("is-valid");
-            },
-            success: function (data) {
-                alert_div_set("success", data.message);
-            },
-            error: function (err) {
-                handle_order_error(err);
-            },
+        reset_feedbacks();
+        get_checked_products()
+            .find("input[field=order-quantity]")
+            .addClass("is-valid");
+        stream_validation(order_obj.products).catch(() => {
+            alert_div_set("error", "伺服器錯誤，請稍後再試！");
         });
     });
 
@@ -1,26 +1,75 @@
+import csv
+import json
 import logging
-from typing import List, Optional
-
+from contextlib import nullcontext
+from datetime import date
+from itertools import chain
+from typing import List, Literal, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q
 from django.db.utils import IntegrityError
-from django.shortcuts import get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.utils.translation import gettext as _
-from ninja import NinjaAPI, Schema
+from django_tables2 import RequestConfig
+from ninja import NinjaAPI, Query, Router, Schema
 
 from manufacturer.models import Manufacturer
-from order.models import Order, OrderProd
+from order.models import Checklist
+from order.tables import CirculatedOrderTable
 from prod.models import (
     Prod,
     ProdCategory,
     QualityAssuranceStatusChoices,
     SalesStatusChoices,
 )
-from utils.order import get_order_no_from_day
+from utils.order import (
+    aresolve_products,
+    apply_checklist_changes,
+    create_orders,
+    get_checklist_totals,
+    get_circulated_order_page,
+    get_rule_snapshot,
+    iter_validate_order,
+)
+from utils.tracing import ValidationTrace
 
 logger = logging.getLogger(__name__)
 
 api = NinjaAPI(urls_namespace="api")
 
+# rows inserted per statement by the bulk product endpoints
+PRODUCT_BATCH_SIZE = 500
+# page size limits of the product listing
+PRODUCT_PAGE_SIZE = 100
+PRODUCT_MAX_PAGE_SIZE = 1000
+# fields selectable by the product listing, foreign keys are listed as their id
+PRODUCT_LIST_FIELDS = tuple(field.name for field in Prod._meta.concrete_fields)
+# columns of the joined manufacturer and category added to the export
+PRODUCT_EXPORT_RELATED_FIELDS = (
+    "prod_mfr_id__mfr_full_id",
+    "prod_mfr_id__mfr_name",
+    "prod_cate_no__cate_name",
+)
+PRODUCT_EXPORT_CHUNK_SIZE = 2000
+
+PRODUCT_NOT_EXIST = {"code": "product_not_exist", "message": "Product not found"}
+PRODUCT_ALREADY_EXIST = {
+    "code": "product_already_exist",
+    "message": "Product with this prod_no already exists",
+}
+INVALID_QUANTITY = {
+    "code": "invalid_quantity",
+    "message": "Product quantity cannot be negative",
+}
+
 
 class ProductCreate(Schema):
     prod_no: int
@@ -32,6 +81,11 @@ class ProductCreate(Schema):
     prod_sales_status: int = SalesStatusChoices.NORMAL
     prod_quality_assurance_status: int = QualityAssuranceStatusChoices.NORMAL
     prod_mfr_id: int
+    prod_cost_price: float = 0
+    prod_retail_price: float = 0
+    prod_sell_zone: str = ""
+    prod_outer_quantity: int = 1
+    prod_inner_quantity: int = 1
 
 
 class ProductUpdate(Schema):
@@ -62,6 +116,11 @@ class ProductOutput(Schema):
     prod_mfr_id_id: int
 
 
+class ProductPage(Schema):
+    results: List[dict]
+    next_cursor: Optional[int] = None
+
+
 class OrderProdSchema(Schema):
     prod_no: int
     prod_quantity: int
@@ -70,6 +129,13 @@ class OrderProdSchema(Schema):
 class OrderSchema(Schema):
     products: List[OrderProdSchema]
     action: str
+    as_of: Optional[date] = None
+    debug: bool = False
+
+
+class OrderValidationSchema(Schema):
+    products: List[OrderProdSchema]
+    as_of: Optional[date] = None
 
 
 class ChecklistProductSchema(Schema):
@@ -83,6 +149,18 @@ class ChecklistSchema(Schema):
     unchecklist: Optional[List[ChecklistProductSchema]] = None
 
 
+class ChecklistTotals(Schema):
+    order_box_quantity: float
+    order_cost_price: float
+    total_quantity: int
+
+
+class CirculatedOrderPage(Schema):
+    results: List[dict]
+    html: str
+    next_cursor: Optional[str] = None
+
+
 class MessageSchema(Schema):
     message: str
 
@@ -95,25 +173,182 @@ class Error(MessageSchema):
 
 class Errors(Schema):
     errors: List[Error]
+    debug: Optional[dict] = None
 
 
 class Success(MessageSchema):
     obj: Optional[str | int] = None
+    debug: Optional[dict] = None
+
+
+@api.get("/products", response={200: ProductPage, 400: Error})
+def list_products(
+    request,
+    cursor: Optional[int] = None,
+    limit: int = PRODUCT_PAGE_SIZE,
+    mfr_id: Optional[int] = None,
+    cate_no: Optional[str] = None,
+    sales_status: Optional[int] = None,
+    quality_assurance_status: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Page through the products in ``prod_no`` order.
+
+    ``cursor`` is the ``next_cursor`` of the previous page, so every page is a
+    range scan on the primary key. ``fields`` is a comma separated list of the
+    columns to return, ``prod_no`` is always included.
+    """
+    products, error = get_product_page_query(
+        cursor, limit, mfr_id, cate_no, sales_status, quality_assurance_status, fields
+    )
+    if error:
+        return 400, error
+    return 200, get_product_page(list(products), limit)
+
+
+def get_product_page_query(
+    cursor, limit, mfr_id, cate_no, sales_status, quality_assurance_status, fields
+):
+    if fields:
+        selected = [field.strip() for field in fields.split(",") if field.strip()]
+        invalid = [field for field in selected if field not in PRODUCT_LIST_FIELDS]
+        if invalid:
+            return None, {
+                "code": "invalid_field",
+                "message": f"Unknown fields: {', '.join(invalid)}",
+            }
+        selected = ["prod_no"] + [field for field in selected if field != "prod_no"]
+    else:
+        selected = list(PRODUCT_LIST_FIELDS)
+    limit = get_product_page_limit(limit)
+
+    products = Prod.objects.order_by("prod_no")
+    if cursor is not None:
+        products = products.filter(prod_no__gt=cursor)
+    if mfr_id is not None:
+        products = products.filter(prod_mfr_id=mfr_id)
+    if cate_no is not None:
+        products = products.filter(
+            Q(prod_cate_no=cate_no)
+            | Q(prod_cate_no__cate_subcate_no=cate_no)
+            | Q(prod_cate_no__cate_cate_no=cate_no)
+        )
+    if sales_status is not None:
+        products = products.filter(prod_sales_status=sales_status)
+    if quality_assurance_status is not None:
+        products = products.filter(
+            prod_quality_assurance_status=quality_assurance_status
+        )
+    # one extra row tells whether there is a next page
+    return products.values(*selected)[: limit + 1], None
+
+
+def get_product_page_limit(limit: int) -> int:
+    return max(1, min(limit, PRODUCT_MAX_PAGE_SIZE))
+
+
+def get_product_page(results: List[dict], limit: int) -> dict:
+    limit = get_product_page_limit(limit)
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = results[-1]["prod_no"]
+    return {"results": results, "next_cursor": next_cursor}
+
+
+class Echo:
+    """A file-like object whose ``write`` returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+@api.get("/products/export")
+def export_products(
+    request,
+    export_format: Literal["csv", "ndjson"] = Query("csv", alias="format"),
+    related: bool = False,
+):
+    """
+    Stream the whole catalog as CSV or NDJSON.
+
+    Rows are read with a server side cursor ``PRODUCT_EXPORT_CHUNK_SIZE`` at a
+    time and written as they are read, so memory does not grow with the
+    catalog.
+    """
+    fields = PRODUCT_LIST_FIELDS
+    if related:
+        fields += PRODUCT_EXPORT_RELATED_FIELDS
+    rows = (
+        Prod.objects.order_by("prod_no")
+        .values_list(*fields)
+        .iterator(chunk_size=PRODUCT_EXPORT_CHUNK_SIZE)
+    )
+    if export_format == "ndjson":
+        lines = (
+            json.dumps(
+                dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False
+            )
+            + "\n"
+            for row in rows
+        )
+        return StreamingHttpResponse(lines, content_type="application/x-ndjson")
+
+    writer = csv.writer(Echo())
+    lines = chain([writer.writerow(fields)], (writer.writerow(row) for row in rows))
+    response = StreamingHttpResponse(lines, content_type="text/csv")
+    response["Content-Disposition"] = 'attachment; filename="products.csv"'
+    return response
 
 
 @api.get("/product/{prod_no}", response={200: ProductOutput, 404: Error})
-def get_product(request, prod_no: int):
+def get_product(request, response: HttpResponse, prod_no: int):
+    # answer conditional requests from the update timestamp alone
+    updated_at = (
+        Prod.objects.filter(prod_no=prod_no)
+        .values_list("prod_updated_at", flat=True)
+        .first()
+    )
+    if updated_at is None:
+        return 404, PRODUCT_NOT_EXIST
+    not_modified = get_product_not_modified(request, prod_no, updated_at)
+    if not_modified is not None:
+        return not_modified
+
     try:
         product = Prod.objects.get(prod_no=prod_no)
     except Prod.DoesNotExist:
-        return 404, {"code": "product_not_exist", "message": "Product not found"}
+        return 404, PRODUCT_NOT_EXIST
 
+    set_product_cache_headers(response, product.prod_no, product.prod_updated_at)
     return 200, product.__dict__
 
 
+def get_product_etag(prod_no: int, updated_at) -> str:
+    return f'W/"{prod_no}-{int(updated_at.timestamp() * 10**6)}"'
+
+
+def get_product_not_modified(request, prod_no: int, updated_at):
+    response = get_conditional_response(
+        request,
+        etag=get_product_etag(prod_no, updated_at),
+        last_modified=int(updated_at.timestamp()),
+    )
+    # a 304 repeats the validators the full response would have sent
+    if response is not None:
+        set_product_cache_headers(response, prod_no, updated_at)
+    return response
+
+
+def set_product_cache_headers(response: HttpResponse, prod_no: int, updated_at):
+    response["ETag"] = get_product_etag(prod_no, updated_at)
+    response["Last-Modified"] = http_date(int(updated_at.timestamp()))
+
+
 @api.post(
     "/product",
-    response={200: Success, 404: Error, 500: Error},
+    response={200: Success, 400: Errors, 404: Error, 500: Error},
 )
 def create_product(request, data: ProductCreate | List[ProductCreate]):
     if not isinstance(data, list):
@@ -140,47 +375,99 @@ def create_product(request, data: ProductCreate | List[ProductCreate]):
                 prod_sales_status=data.prod_sales_status,
                 prod_quality_assurance_status=data.prod_quality_assurance_status,
                 prod_mfr_id=manufacturer,
+                prod_cost_price=data.prod_cost_price,
+                prod_retail_price=data.prod_retail_price,
+                prod_sell_zone=data.prod_sell_zone,
+                prod_outer_quantity=data.prod_outer_quantity,
+                prod_inner_quantity=data.prod_inner_quantity,
             )
         except IntegrityError:
-            return 500, {
-                "code": "product_already_exist",
-                "message": "Product with this prod_no already exists",
-            }
+            return 500, PRODUCT_ALREADY_EXIST
         return 200, {"message": "Product created successfully"}
 
-    products = []
-    for product_data in data:
-        product_category = get_object_or_404(
-            ProdCategory, cate_no=product_data.prod_cate_no
-        )
-        manufacturer = get_object_or_404(Manufacturer, mfr_id=product_data.prod_mfr_id)
-        try:
-            product = Prod.objects.get(prod_no=product_data.prod_no)
-            if product:
-                return 500, {
+    categories = ProdCategory.objects.in_bulk(
+        {product_data.prod_cate_no for product_data in data}
+    )
+    manufacturers = Manufacturer.objects.in_bulk(
+        {product_data.prod_mfr_id for product_data in data}
+    )
+    existing_prod_nos = set(
+        Prod.objects.filter(
+            prod_no__in=[product_data.prod_no for product_data in data]
+        ).values_list("prod_no", flat=True)
+    )
+    errors, product_objects = check_product_rows(
+        data, categories, manufacturers, existing_prod_nos
+    )
+    if errors:
+        return 400, {"errors": errors}
+
+    try:
+        bulk_create_products(product_objects)
+    except IntegrityError:
+        # created by another request since the duplicate check
+        return 500, PRODUCT_ALREADY_EXIST
+    return 200, {"message": f"Products created successfully [{len(product_objects)}]"}
+
+
+def check_product_rows(
+    data: List[ProductCreate],
+    categories: dict,
+    manufacturers: dict,
+    existing_prod_nos: set,
+) -> Tuple[List[dict], List[Prod]]:
+    """The errors of every row and the products to create if there is none."""
+    errors = []
+    product_objects = []
+    for row, product_data in enumerate(data):
+        if product_data.prod_no in existing_prod_nos:
+            errors.append(
+                {
                     "code": "product_already_exist",
-                    "message": "Product with this prod_no already exists",
+                    "message": f"Product {product_data.prod_no} already exists",
+                    "obj": row,
+                    "obj_type": "row",
                 }
-        except:
-            pass
-        product_data.prod_cate_no = product_category
-        product_data.prod_mfr_id = manufacturer
-        products.append(product_data)
-    product_objects = []
-    for product_data in products:
-        product = Prod.objects.create(
-            prod_no=product_data.prod_no,
-            prod_name=product_data.prod_name,
-            prod_desc=product_data.prod_desc,
-            prod_img=product_data.prod_img,
-            prod_quantity=product_data.prod_quantity,
-            prod_cate_no=product_data.prod_cate_no,
-            prod_sales_status=product_data.prod_sales_status,
-            prod_quality_assurance_status=product_data.prod_quality_assurance_status,
-            prod_mfr_id=product_data.prod_mfr_id,
+            )
+            continue
+        # a prod_no repeated in the list is reported on its later rows
+        existing_prod_nos.add(product_data.prod_no)
+        product_category = categories.get(product_data.prod_cate_no)
+        if product_category is None:
+            errors.append(
+                {
+                    "code": "category_not_exist",
+                    "message": f"Category {product_data.prod_cate_no} not found",
+                    "obj": row,
+                    "obj_type": "row",
+                }
+            )
+        manufacturer = manufacturers.get(product_data.prod_mfr_id)
+        if manufacturer is None:
+            errors.append(
+                {
+                    "code": "manufacturer_not_exist",
+                    "message": f"Manufacturer {product_data.prod_mfr_id} not found",
+                    "obj": row,
+                    "obj_type": "row",
+                }
+            )
+        if errors:
+            # nothing is created once a row failed, keep checking the rest
+            continue
+        product_objects.append(
+            Prod(
+                **product_data.dict(exclude={"prod_cate_no", "prod_mfr_id"}),
+                prod_cate_no=product_category,
+                prod_mfr_id=manufacturer,
+            )
         )
-        product_objects.append(product)
-    return 200, {"message": f"Products created successfully [{len(product_objects)}]"}
+    return errors, product_objects
+
+
+def bulk_create_products(product_objects: List[Prod]):
+    with transaction.atomic():
+        Prod.objects.bulk_create(product_objects, batch_size=PRODUCT_BATCH_SIZE)
 
 
 @api.put("/product/{prod_no}", response={200: ProductOutput, 404: Error})
@@ -218,113 +505,433 @@ def update_product(request, prod_no: int, data: ProductUpdate):
     return 200, product
 
 
-@api.put("/product", response={200: Success, 404: Error})
-def update_products(request, data: List[ProductUpdateQuantity]):
+@api.put("/product", response={200: Success, 400: Error, 404: Error})
+def update_products(
+    request, data: List[ProductUpdateQuantity], mode: Literal["set", "delta"] = "set"
+):
+    """
+    Set the quantity of every product, or add to it with ``mode=delta``.
+
+    Only ``prod_quantity`` is written, ``PRODUCT_BATCH_SIZE`` products per
+    ``UPDATE ... CASE`` statement; deltas are applied with ``F`` expressions so
+    concurrent stock movements are not lost.
+    """
+    quantities = get_product_quantities(data, mode)
+    chunks = get_prod_no_chunks(quantities)
+    for chunk in chunks:
+        existing = set(
+            Prod.objects.filter(prod_no__in=chunk).values_list("prod_no", flat=True)
+        )
+        error = find_missing_product(chunk, existing)
+        if error:
+            return 404, error
+
+    try:
+        bulk_update_quantities(chunks, quantities, mode)
+    except IntegrityError:
+        return 400, INVALID_QUANTITY
+    return 200, {"message": f"Products updated successfully [{len(quantities)}]"}
+
+
+def get_product_quantities(data: List[ProductUpdateQuantity], mode: str) -> dict:
+    quantities = dict()
     for product_data in data:
-        try:
-            product = Prod.objects.get(prod_no=product_data.prod_no)
-        except product.DoesNotExist:
-            return 404, {
-                "code": "product_not_exist",
-                "message": f"Product {product_data.prod_no} not found",
-            }
+        if mode == "delta":
+            quantities[product_data.prod_no] = (
+                quantities.get(product_data.prod_no, 0) + product_data.prod_quantity
+            )
+        else:
+            quantities[product_data.prod_no] = product_data.prod_quantity
+    return quantities
 
-        product.prod_quantity = product_data.prod_quantity
-        product.save()
 
-    return 200, {"message": "Products updated successfully"}
+def get_prod_no_chunks(quantities: dict) -> List[List[int]]:
+    prod_nos = list(quantities)
+    return [
+        prod_nos[start : start + PRODUCT_BATCH_SIZE]
+        for start in range(0, len(prod_nos), PRODUCT_BATCH_SIZE)
+    ]
+
+
+def find_missing_product(chunk: List[int], existing: set) -> Optional[dict]:
+    for prod_no in chunk:
+        if prod_no not in existing:
+            return {
+                "code": "product_not_exist",
+                "message": f"Product {prod_no} not found",
+                "obj": prod_no,
+            }
+    return None
+
+
+def bulk_update_quantities(chunks: List[List[int]], quantities: dict, mode: str):
+    # bulk_update skips auto_now, keep the ETag of the products in sync
+    now = timezone.now()
+    with transaction.atomic():
+        for chunk in chunks:
+            Prod.objects.bulk_update(
+                [
+                    Prod(
+                        prod_no=prod_no,
+                        prod_quantity=(
+                            F("prod_quantity") + quantities[prod_no]
+                            if mode == "delta"
+                            else quantities[prod_no]
+                        ),
+                        prod_updated_at=now,
+                    )
+                    for prod_no in chunk
+                ],
+                ["prod_quantity", "prod_updated_at"],
+            )
 
 
 @api.post("/order", response={200: Success, 400: Errors})
 def create_order(request, data: OrderSchema):
+    error_list, mfr_prod_dict, debug = check_order(data)
+    response = get_check_order_response(data, error_list, debug)
+    if response is not None:
+        return response
+    return get_created_order_response(place_orders(request.user, mfr_prod_dict))
+
+
+def check_order(data: OrderSchema, snapshot=None, prods=None):
     from utils.order import validate_order
 
-    error_list, mfr_prod_dict = validate_order(data.products)
+    trace = None
+    if data.debug or settings.ORDER_VALIDATION_TRACE:
+        trace = ValidationTrace()
+    # orders are written today, only a validation may look at another day
+    as_of = data.as_of if data.action == "validation" else None
+    with trace.activate() if trace else nullcontext():
+        error_list, mfr_prod_dict = validate_order(
+            data.products, snapshot=snapshot, as_of=as_of, prods=prods
+        )
+    debug = {"debug": trace.as_dict()} if data.debug else {}
     for mfr, prods in mfr_prod_dict.items():
         logger.debug(f"manufacturer: {mfr}")
         for prod, prod_quantity in prods:
             logger.debug(f"\tproduct: {prod}, quantity: {prod_quantity}")
+    return error_list, mfr_prod_dict, debug
+
+
+def get_check_order_response(data: OrderSchema, error_list, debug):
+    """The response of an order that is not created, None to create it."""
+    if data.action == "create" and data.as_of is not None:
+        return 400, {
+            "errors": [
+                {
+                    "code": "invalid_field",
+                    "message": _("建立訂單時不可指定驗證日期"),
+                    "obj": "as_of",
+                }
+            ]
+        }
     if len(error_list) != 0:
         logger.debug(f"error_list:\n{error_list}")
-        return 400, {"errors": error_list}
+        return 400, {"errors": error_list, **debug}
     if data.action == "validation":
-        return 200, {"message": _("訂單驗證成功")}
+        return 200, {"message": _("訂單驗證成功"), **debug}
     elif data.action == "create":
-        od_no_list = []
-        for mfr, prods in mfr_prod_dict.items():
-            # TODO: slice prods to multiple orders if prods exceed 5 or a specific number
-            order = Order.objects.create(
-                od_no=get_order_no_from_day() + 1,
-                od_mfr_id=mfr,
-                od_except_arrival_date=timezone.localdate()
-                + timezone.timedelta(days=7),
-            )
-
-            od_no_list.append(str(order.od_no))
-
-            for prod, order_quantity in prods:
-                OrderProd.objects.create(
-                    op_od_no=order, op_prod_no=prod, op_quantity=order_quantity
-                )
-
-        if "checklist" in request.session:
-            request.session.pop("checklist")
-
-        # TODO: implement for multiple orders
-        od_no = od_no_list[0] if len(od_no_list) == 1 else ", ".join(od_no_list)
-        return 200, {
-            "message": _("訂單 {od_no} 建立成功").format(od_no=od_no),
-            "obj": od_no,
-        }
+        return None
     else:
         return 400, {"message": _("未知操作")}
 
 
+def place_orders(user, mfr_prod_dict) -> List[str]:
+    """Create the orders and clear the ordered products from the checklist."""
+    orders = create_orders(mfr_prod_dict)
+    if user.is_authenticated:
+        Checklist.objects.filter(
+            cl_user_id=user,
+            cl_prod_no__in=[
+                prod.prod_no
+                for prods in mfr_prod_dict.values()
+                for prod, order_quantity in prods
+            ],
+        ).delete()
+    return [str(order.od_no) for order in orders]
+
+
+def get_created_order_response(od_no_list: List[str]):
+    # TODO: implement for multiple orders
+    od_no = od_no_list[0] if len(od_no_list) == 1 else ", ".join(od_no_list)
+    return 200, {
+        "message": _("訂單 {od_no} 建立成功").format(od_no=od_no),
+        "obj": od_no,
+    }
+
+
+@api.post("/order/validation")
+def stream_validate_order(request, data: OrderValidationSchema):
+    # take the snapshot now, the records are generated after the view returns
+    records = iter_validate_order(
+        data.products, snapshot=get_rule_snapshot(), as_of=data.as_of
+    )
+    return StreamingHttpResponse(
+        (json.dumps(record, ensure_ascii=False) + "\n" for record in records),
+        content_type="application/x-ndjson",
+    )
+
+
 @api.post("/checklist", response={200: Success, 400: Error})
 def update_checklist(request, data: ChecklistSchema):
     logger.debug(data)
-    if data.checklist:
-        new_checklist = data.checklist
-
-    if "checklist" in request.session:
-        checklist_tuple_list = request.session.get("checklist")
-        # promise that there is only one checklist tuple in the list
-        [checklist_tuple] = checklist_tuple_list
-        mfr_full_id, checklist = checklist_tuple
-        logger.debug(f"(session)\nmfr_full_id: {mfr_full_id}, checklist: {checklist}")
-        if mfr_full_id == data.mfr_full_id and len(checklist) > 0:
-            new_checklist_dict = {c["prod_no"]: c["order_quantity"] for c in checklist}
-            new_checklist_dict_keys = new_checklist_dict.keys()
-
-            if data.unchecklist:
-                unchecklist_prod_no_list = [c.prod_no for c in data.unchecklist]
-                for prod_no in unchecklist_prod_no_list:
-                    if prod_no in new_checklist_dict_keys:
-                        new_checklist_dict.pop(prod_no)
-
-            if data.checklist:
-                for prod_order_quantity in data.checklist:
-                    new_checklist_dict.update(
-                        {
-                            prod_order_quantity.prod_no: prod_order_quantity.order_quantity
-                        }
-                    )
+    if not request.user.is_authenticated:
+        return 400, {"code": "login_required", "message": _("請先登入")}
+
+    checked = {c.prod_no: c.order_quantity for c in data.checklist or []}
+    unchecked = [c.prod_no for c in data.unchecklist or [] if c.prod_no not in checked]
+    for prod_no, order_quantity in checked.items():
+        if order_quantity < 0:
+            return 400, {**INVALID_QUANTITY, "obj": prod_no}
+    # only products of the manufacturer can be checked on its page
+    existing = set(
+        Prod.objects.filter(
+            prod_no__in=checked, prod_mfr_id__mfr_full_id=data.mfr_full_id
+        ).values_list("prod_no", flat=True)
+    )
+    error = find_missing_product(list(checked), existing)
+    if error:
+        return 400, error
+    apply_checklist_changes(request.user, data.mfr_full_id, checked, unchecked)
+    return {"message": _("成功更新"), "obj": data.mfr_full_id}
+
+
+@api.get("/checklist/totals", response={200: ChecklistTotals, 400: Error})
+def checklist_totals(request, mfr_full_id: str):
+    if not request.user.is_authenticated:
+        return 400, {"code": "login_required", "message": _("請先登入")}
+    return 200, get_checklist_totals(request.user, mfr_full_id)
+
+
+@api.get(
+    "/circulated-order/products",
+    response={200: CirculatedOrderPage, 400: Error, 403: Error},
+)
+def list_circulated_order_products(
+    request,
+    cursor: Optional[str] = None,
+    limit: int = PRODUCT_PAGE_SIZE,
+    mfr_user_id: Optional[int] = None,
+):
+    """
+    Feed of the circulated order grid over every manufacturer of a buyer.
+
+    Each page holds the product data and the same rows rendered by
+    ``CirculatedOrderTable``, so the page appends them as it scrolls. Only
+    staff may list the manufacturers of another buyer.
+    """
+    if not request.user.is_authenticated:
+        return 400, {"code": "login_required", "message": _("請先登入")}
+    buyer = request.user
+    if mfr_user_id is not None and mfr_user_id != request.user.pk:
+        if not request.user.is_staff:
+            return 403, {"code": "permission_denied", "message": _("無權限")}
+        buyer = mfr_user_id
+    try:
+        products, next_cursor = get_circulated_order_page(
+            buyer, cursor, get_product_page_limit(limit)
+        )
+    except ValueError:
+        return 400, {"code": "invalid_cursor", "message": _("無效的游標")}
+
+    table = CirculatedOrderTable(products, orderable=False, show_footer=False)
+    RequestConfig(request, paginate=False).configure(table)
+    table.load_checklists({prod.prod_mfr_id.mfr_full_id for prod in products})
+    results = []
+    for prod in products:
+        mfr = prod.prod_mfr_id
+        suggestion = getattr(prod, "suggestion", None)
+        results.append(
+            {
+                "prod_no": prod.prod_no,
+                "prod_name": prod.prod_name,
+                "prod_quantity": prod.prod_quantity,
+                "mfr_id": mfr.mfr_id,
+                "mfr_full_id": mfr.mfr_full_id,
+                "mfr_name": mfr.mfr_name,
+                "suggested_quantity": (
+                    suggestion.rs_suggested_quantity if suggestion else 0
+                ),
+                "order_quantity": table.get_checklist(mfr.mfr_full_id).get(
+                    prod.prod_no
+                ),
+            }
+        )
+    html = render_to_string(
+        "include/circulated_order_rows.html", {"table": table}, request
+    )
+    return 200, {"results": results, "html": html, "next_cursor": next_cursor}
 
-            new_checklist_dict_list = [
-                {"prod_no": k, "order_quantity": v}
-                for k, v in new_checklist_dict.items()
-            ]
 
-            logger.debug("mfr_full_id matched")
-            logger.debug(f"new checklist: {new_checklist_dict_list}")
-        else:
-            logger.debug("mfr_full_id not matched")
-            new_checklist_dict_list = [c.dict() for c in new_checklist]
-    else:
-        logger.debug("no checklist in session")
-        new_checklist_dict_list = [c.dict() for c in new_checklist]
+# Async variants of the product and order endpoints, for running under ASGI.
+# Transactions are not available to async code, the transactional writes run
+# in a thread with sync_to_async.
+async_router = Router()
+
+
+@async_router.get(
+    "/products",
+    response={200: ProductPage, 400: Error},
+    url_name="async_list_products",
+)
+async def async_list_products(
+    request,
+    cursor: Optional[int] = None,
+    limit: int = PRODUCT_PAGE_SIZE,
+    mfr_id: Optional[int] = None,
+    cate_no: Optional[str] = None,
+    sales_status: Optional[int] = None,
+    quality_assurance_status: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    products, error = get_product_page_query(
+        cursor, limit, mfr_id, cate_no, sales_status, quality_assurance_status, fields
+    )
+    if error:
+        return 400, error
+    return 200, get_product_page([product async for product in products], limit)
+
+
+@async_router.get(
+    "/product/{prod_no}",
+    response={200: ProductOutput, 404: Error},
+    url_name="async_get_product",
+)
+async def async_get_product(request, response: HttpResponse, prod_no: int):
+    updated_at = await (
+        Prod.objects.filter(prod_no=prod_no)
+        .values_list("prod_updated_at", flat=True)
+        .afirst()
+    )
+    if updated_at is None:
+        return 404, PRODUCT_NOT_EXIST
+    not_modified = get_product_not_modified(request, prod_no, updated_at)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        product = await Prod.objects.aget(prod_no=prod_no)
+    except Prod.DoesNotExist:
+        return 404, PRODUCT_NOT_EXIST
+
+    set_product_cache_headers(response, product.prod_no, product.prod_updated_at)
+    return 200, product.__dict__
+
 
-    new_checklist_tuple_list = [(data.mfr_full_id, new_checklist_dict_list)]
-    request.session["checklist"] = new_checklist_tuple_list
-    logger.debug(f"new checklist tuple list: {new_checklist_tuple_list}")
-    return {"message": _("成功更新"), "obj": str(new_checklist_tuple_list)}
+@async_router.post(
+    "/product",
+    response={200: Success, 400: Errors, 404: Error, 500: Error},
+    url_name="async_create_product",
+)
+async def async_create_product(request, data: ProductCreate | List[ProductCreate]):
+    if not isinstance(data, list):
+        try:
+            product_category = await ProdCategory.objects.aget(
+                cate_no=data.prod_cate_no
+            )
+        except ProdCategory.DoesNotExist:
+            return 404, {"code": "category_not_exist", "message": "Category not found"}
+
+        try:
+            manufacturer = await Manufacturer.objects.aget(mfr_id=data.prod_mfr_id)
+        except Manufacturer.DoesNotExist:
+            return 404, {
+                "code": "manufacturer_not_exist",
+                "message": "Manufacturer not found",
+            }
+        try:
+            await Prod.objects.acreate(
+                prod_no=data.prod_no,
+                prod_name=data.prod_name,
+                prod_desc=data.prod_desc,
+                prod_img=data.prod_img,
+                prod_quantity=data.prod_quantity,
+                prod_cate_no=product_category,
+                prod_sales_status=data.prod_sales_status,
+                prod_quality_assurance_status=data.prod_quality_assurance_status,
+                prod_mfr_id=manufacturer,
+                prod_cost_price=data.prod_cost_price,
+                prod_retail_price=data.prod_retail_price,
+                prod_sell_zone=data.prod_sell_zone,
+                prod_outer_quantity=data.prod_outer_quantity,
+                prod_inner_quantity=data.prod_inner_quantity,
+            )
+        except IntegrityError:
+            return 500, PRODUCT_ALREADY_EXIST
+        return 200, {"message": "Product created successfully"}
+
+    categories = await ProdCategory.objects.ain_bulk(
+        {product_data.prod_cate_no for product_data in data}
+    )
+    manufacturers = await Manufacturer.objects.ain_bulk(
+        {product_data.prod_mfr_id for product_data in data}
+    )
+    existing_prod_nos = {
+        prod_no
+        async for prod_no in Prod.objects.filter(
+            prod_no__in=[product_data.prod_no for product_data in data]
+        ).values_list("prod_no", flat=True)
+    }
+    errors, product_objects = check_product_rows(
+        data, categories, manufacturers, existing_prod_nos
+    )
+    if errors:
+        return 400, {"errors": errors}
+
+    try:
+        await sync_to_async(bulk_create_products)(product_objects)
+    except IntegrityError:
+        return 500, PRODUCT_ALREADY_EXIST
+    return 200, {"message": f"Products created successfully [{len(product_objects)}]"}
+
+
+@async_router.put(
+    "/product",
+    response={200: Success, 400: Error, 404: Error},
+    url_name="async_update_products",
+)
+async def async_update_products(
+    request, data: List[ProductUpdateQuantity], mode: Literal["set", "delta"] = "set"
+):
+    quantities = get_product_quantities(data, mode)
+    chunks = get_prod_no_chunks(quantities)
+    for chunk in chunks:
+        existing = {
+            prod_no
+            async for prod_no in Prod.objects.filter(prod_no__in=chunk).values_list(
+                "prod_no", flat=True
+            )
+        }
+        error = find_missing_product(chunk, existing)
+        if error:
+            return 404, error
+
+    try:
+        await sync_to_async(bulk_update_quantities)(chunks, quantities, mode)
+    except IntegrityError:
+        return 400, INVALID_QUANTITY
+    return 200, {"message": f"Products updated successfully [{len(quantities)}]"}
+
+
+@async_router.post(
+    "/order",
+    response={200: Success, 400: Errors},
+    url_name="async_create_order",
+)
+async def async_create_order(request, data: OrderSchema):
+    # the snapshot checks the shared rule version through the sync ORM, the
+    # products are read with the async ORM and the rules are then checked in
+    # memory; only the transactional write runs in a thread
+    snapshot = await sync_to_async(get_rule_snapshot)()
+    prods = await aresolve_products(data.products)
+    error_list, mfr_prod_dict, debug = check_order(data, snapshot, prods)
+    response = get_check_order_response(data, error_list, debug)
+    if response is not None:
+        return response
+    od_no_list = await sync_to_async(place_orders)(request.user, mfr_prod_dict)
+    return get_created_order_response(od_no_list)
+
+
+api.add_router("/async", async_router)
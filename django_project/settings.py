@@ -83,6 +83,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # local
+    "order.middleware.OrderRuleVersionMiddleware",
     # 3rd party
     # "django_browser_reload.middleware.BrowserReloadMiddleware",
     "debug_toolbar.middleware.DebugToolbarMiddleware",
@@ -139,6 +141,10 @@ CONSTANCE_CONFIG = OrderedDict(
             "CIRCULATED_ORDER_PER_PAGE_ITEMS",
             (40, "設定定期訂貨頁面的產品預設顯示數目", int),
         ),
+        (
+            "ORDER_MAX_PRODUCTS",
+            (0, "設定每張訂單的最多商品數，超過時拆成多張訂單 (0 為不限制)", int),
+        ),
     ]
 )
 
@@ -149,7 +155,7 @@ CONSTANCE_CONFIG_FIELDSETS = {
         "BOOL",
         "FLOAT",
     ),
-    "訂單": ("CIRCULATED_ORDER_PER_PAGE_ITEMS",),
+    "訂單": ("CIRCULATED_ORDER_PER_PAGE_ITEMS", "ORDER_MAX_PRODUCTS"),
 }
 
 
@@ -298,6 +304,11 @@ LOGGING = {
             "level": env.str("APP_LOG_LEVEL", default="DEBUG"),
             "propagate": False,
         },
+        "utils": {
+            "handlers": ["console", "file"],
+            "level": env.str("APP_LOG_LEVEL", default="DEBUG"),
+            "propagate": False,
+        },
         # 3rd party
         "debug_toolbar": {
             "handlers": ["console"],
@@ -312,3 +323,10 @@ APP_TITLE = env.str("TITLE", default="Django Project")
 
 # Profiler
 SILKY_PYTHON_PROFILER = True
+
+# Order validation tracing, the sink is called with the metrics of each traced
+# validation
+ORDER_VALIDATION_TRACE = env.bool("ORDER_VALIDATION_TRACE", default=False)
+ORDER_VALIDATION_METRICS_SINK = env.str(
+    "ORDER_VALIDATION_METRICS_SINK", default="utils.tracing.log_metrics"
+)
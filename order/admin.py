@@ -1,6 +1,12 @@
 from django.contrib import admin
 
-from order.models import Order, OrderProd, OrderRule
+from order.models import (
+    Checklist,
+    Order,
+    OrderProd,
+    OrderRule,
+    ReplenishmentSuggestion,
+)
 
 from .forms import OrderProdCreateForm, OrderRuleCreateForm
 
@@ -45,3 +51,24 @@ class OrderRulesAdmin(admin.ModelAdmin):
         "or_effective_start_date",
         "or_effective_end_date",
     ]
+
+
+@admin.register(Checklist)
+class ChecklistAdmin(admin.ModelAdmin):
+    list_display = [
+        "cl_id",
+        "cl_user_id",
+        "cl_mfr_full_id",
+        "cl_prod_no",
+        "cl_order_quantity",
+    ]
+
+
+@admin.register(ReplenishmentSuggestion)
+class ReplenishmentSuggestionAdmin(admin.ModelAdmin):
+    list_display = [
+        "rs_prod_no",
+        "rs_daily_demand",
+        "rs_suggested_quantity",
+        "rs_computed_at",
+    ]
@@ -1,6 +1,7 @@
 import django_filters
 from dal import autocomplete
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 from django.utils.translation import gettext_lazy as _
 
 from manufacturer.models import Manufacturer
@@ -11,14 +12,35 @@ from .models import Order, OrderProd, OrderRule, OrderRuleTypeChoices
 
 class OrderFilter(django_filters.FilterSet):
     def orderprod_prod_filter(self, queryset, name, value):
-        ops = OrderProd.objects.filter(op_prod_no=value.pk)
-        filtered_queryset = queryset.filter(orderprod_set__in=ops)
-        return filtered_queryset
+        # answered by the (op_od_no, op_prod_no) unique index for each order
+        ops = OrderProd.objects.filter(op_od_no=OuterRef("pk"), op_prod_no=value.pk)
+        return queryset.filter(Exists(ops))
 
     def order_no_filter(self, queryset, name, value):
         queryset = queryset.filter(od_no=value.pk)
         return queryset
 
+    def order_search_filter(self, queryset, name, value):
+        # user and date filters read the OrderSearch indexes, not the order joins
+        return queryset.filter(**{f"search__{self.search_fields[name]}": value})
+
+    def order_search_date_filter(self, queryset, name, value):
+        field = f"search__{self.search_fields[name]}"
+        if value.start is not None:
+            queryset = queryset.filter(**{f"{field}__gte": value.start})
+        if value.stop is not None:
+            queryset = queryset.filter(**{f"{field}__lte": value.stop})
+        return queryset
+
+    # OrderSearch column of each filter
+    search_fields = {
+        "od_mfr_id": "os_mfr_id",
+        "od_mfr_id__mfr_user_id": "os_user_id",
+        "od_date": "os_date",
+        "od_except_arrival_date": "os_except_arrival_date",
+        "od_notes": "os_notes__icontains",
+    }
+
     od_no = django_filters.ModelChoiceFilter(
         label="訂單編號",
         required=False,
@@ -60,10 +82,12 @@ class OrderFilter(django_filters.FilterSet):
             },
         ),
         queryset=Manufacturer.objects.all(),
+        method="order_search_filter",
     )
 
     od_mfr_id__mfr_user_id = django_filters.ModelChoiceFilter(
         label="訂貨人員",
+        method="order_search_filter",
         widget=autocomplete.ModelSelect2(
             url="mfr_username_autocomplete",
             attrs={
@@ -75,8 +99,13 @@ class OrderFilter(django_filters.FilterSet):
         queryset=get_user_model().objects.all(),
     )
 
-    od_date = django_filters.DateFromToRangeFilter(label="訂貨日期")
-    od_except_arrival_date = django_filters.DateFromToRangeFilter(label="預期到貨日")
+    od_date = django_filters.DateFromToRangeFilter(
+        label="訂貨日期", method="order_search_date_filter"
+    )
+    od_except_arrival_date = django_filters.DateFromToRangeFilter(
+        label="預期到貨日", method="order_search_date_filter"
+    )
+    od_notes = django_filters.CharFilter(label="備註", method="order_search_filter")
 
     class Meta:
         model = Order
@@ -13,7 +13,7 @@ from django.utils.translation import gettext_lazy as _
 
 from manufacturer.models import Manufacturer
 from prod.models import Prod
-from utils.order import OrderProdSchema, check_product_rule
+from utils.order import OrderProdSchema, check_product_rule, get_rule_snapshot
 
 from .models import Order, OrderProd, OrderRule
 
@@ -117,7 +117,13 @@ class OrderProdCreateForm(forms.ModelForm):
         prod = OrderProdSchema(**prod_dict)
         logger.debug(prod)
 
-        error_list = check_product_rule(prod)
+        # check against the rules in effect on the order date
+        snapshot = get_rule_snapshot()
+        order = self.cleaned_data.get("op_od_no")
+        if order is not None:
+            snapshot = snapshot.as_of(timezone.localdate(order.od_date))
+
+        error_list = check_product_rule(prod, snapshot=snapshot)
         logger.debug(f"product rule check: {error_list}")
 
         for error in error_list:
@@ -387,7 +393,7 @@ OrderFormset = modelformset_factory(Order, OrderCreateForm, extra=3)
 
 
 class OrderRuleCreateForm(forms.ModelForm):
-    # TODO: check effective start / end date overlap
+    # effective start / end date overlap is checked by OrderRule.clean
     class Meta:
         fields = "__all__"
         model = OrderRule
@@ -0,0 +1,287 @@
+import json
+import random
+import time
+import tracemalloc
+from itertools import islice
+from typing import Any, Callable, Iterator, List
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from manufacturer.models import Manufacturer
+from order.models import OrderRule, OrderRuleTypeChoices
+from prod.models import CateTypeChoices, Prod, ProdCategory
+from utils.order import (
+    OrderProdSchema,
+    bump_rule_version,
+    check_category_rule,
+    check_manufacturer_rule,
+    get_rule_snapshot,
+    group_by,
+    resolve_products,
+    rule_snapshots,
+    validate_order,
+)
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        "benchmark order validation against synthetic catalogs, "
+        "the seeded data is rolled back after every catalog size"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--products",
+            type=int,
+            nargs="+",
+            default=[1_000, 100_000, 1_000_000],
+            help="catalog sizes",
+        )
+        parser.add_argument(
+            "--rules", type=int, default=10_000, help="rules seeded per catalog"
+        )
+        parser.add_argument(
+            "--lines",
+            type=int,
+            nargs="+",
+            default=[10, 1_000, 10_000],
+            help="order sizes",
+        )
+        parser.add_argument(
+            "--manufacturers", type=int, default=100, help="manufacturers seeded"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3, help="timed runs, the best is kept"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="random seed")
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help=(
+                "seed even when the catalog tables have rows, only for a "
+                "throwaway database"
+            ),
+        )
+        parser.add_argument(
+            "--output", type=str, default="order_bench.json", help="JSON report"
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> str | None:
+        # seeding deletes the catalog and holds the tables until the rollback
+        seeded = [
+            model.__name__
+            for model in (Manufacturer, ProdCategory, Prod, OrderRule)
+            if model.objects.exists()
+        ]
+        if seeded and not options["force"]:
+            raise CommandError(
+                f"{', '.join(seeded)} already have rows, run the benchmark "
+                "against an empty database or pass --force"
+            )
+        random.seed(options["seed"])
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "options": {
+                key: options[key]
+                for key in ("products", "rules", "lines", "manufacturers", "repeat")
+            },
+            "runs": [],
+        }
+        for nums in options["products"]:
+            self.stdout.write(f"seeding {nums} products, {options['rules']} rules...")
+            with transaction.atomic():
+                seed_time = timed(
+                    lambda: seed_catalog(
+                        nums, options["rules"], options["manufacturers"]
+                    )
+                )
+                prod_nos = list(Prod.objects.values_list("prod_no", flat=True))
+                for lines in options["lines"]:
+                    if lines > len(prod_nos):
+                        continue
+                    run = run_bench(random.sample(prod_nos, lines), options["repeat"])
+                    run.update(products=nums, rules=options["rules"], lines=lines)
+                    run["seed_time"] = seed_time
+                    report["runs"].append(run)
+                    self.stdout.write(format_run(run))
+                transaction.set_rollback(True)
+            rule_snapshots.invalidate()
+
+        with open(options["output"], "w") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"report written to {options['output']}")
+
+
+def timed(func: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def measure(func: Callable[[], Any], repeat: int = 1) -> dict:
+    """Best wall time of ``repeat`` runs and the queries of the last one."""
+    best = None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            elapsed = timed(func)
+        best = elapsed if best is None else min(best, elapsed)
+    return {"time": best, "queries": len(queries)}
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_bench(prod_nos: List[int], repeat: int) -> dict:
+    data = [
+        OrderProdSchema(prod_no=prod_no, prod_quantity=random.randint(1, 50))
+        for prod_no in prod_nos
+    ]
+
+    def validate():
+        return validate_order(data)
+
+    # the first validation after seeding builds the rule snapshot
+    rule_snapshots.invalidate()
+    run = {"validate_order": {"cold": measure(validate)}}
+    run["validate_order"]["warm"] = measure(validate, repeat)
+    run["validate_order"]["peak_memory"] = peak_memory(validate)
+    run["errors"] = len(validate()[0])
+
+    snapshot = get_rule_snapshot()
+    prods = resolve_products(data)
+    prod_dict = {prods[line.prod_no]: line.prod_quantity for line in data}
+    run["check_category_rule"] = measure(
+        lambda: check_category_rule(prod_dict, snapshot), repeat
+    )
+    run["check_manufacturer_rule"] = measure(
+        lambda: check_manufacturer_rule(prod_dict, snapshot), repeat
+    )
+    run["manufacturers"] = len(group_by(prod_dict, "manufacturer"))
+    return run
+
+
+def format_run(run: dict) -> str:
+    cold, warm = run["validate_order"]["cold"], run["validate_order"]["warm"]
+    return (
+        f"{run['products']:>9} products {run['lines']:>6} lines: "
+        f"cold {cold['time']:.4f}s/{cold['queries']}q, "
+        f"warm {warm['time']:.4f}s/{warm['queries']}q, "
+        f"peak {run['validate_order']['peak_memory'] / 2**20:.1f} MiB, "
+        f"category {run['check_category_rule']['time']:.4f}s, "
+        f"manufacturer {run['check_manufacturer_rule']['time']:.4f}s, "
+        f"{run['errors']} errors"
+    )
+
+
+def batched(objs: Iterator[Any], size: int = BATCH_SIZE) -> Iterator[List[Any]]:
+    while batch := list(islice(objs, size)):
+        yield batch
+
+
+def seed_catalog(nums: int, rules: int, manufacturers: int) -> None:
+    # bulk writes skip the signals, the rule version is bumped once at the end
+    OrderRule.objects.all().delete()
+    Prod.objects.all().delete()
+    ProdCategory.objects.all().delete()
+    Manufacturer.objects.all().delete()
+
+    Manufacturer.objects.bulk_create(
+        Manufacturer(
+            mfr_main_id=f"{90000000 + i}",
+            mfr_sub_id="00",
+            mfr_name=f"Bench Factory {i}",
+            mfr_address="Taipei",
+        )
+        for i in range(manufacturers)
+    )
+    mfrs = list(Manufacturer.objects.all())
+
+    categories = []
+    for i in range(1, 11):
+        categories.append(
+            ProdCategory(cate_no=f"{i:0>6}", cate_type=CateTypeChoices.Cate)
+        )
+        for j in range(1, 11):
+            categories.append(
+                ProdCategory(
+                    cate_no=f"00{i:02}{j:02}", cate_type=CateTypeChoices.SubCate
+                )
+            )
+            for k in range(1, 11):
+                categories.append(
+                    ProdCategory(
+                        cate_no=f"{i:02}{j:02}{k:02}",
+                        cate_type=CateTypeChoices.SubSubCate,
+                    )
+                )
+    for cate in categories:
+        cate.cate_name = f"Bench {cate.cate_no}"
+    ProdCategory.objects.bulk_create(categories)
+    leaves = [c for c in categories if c.cate_type == CateTypeChoices.SubSubCate]
+
+    prods = (
+        Prod(
+            prod_name=f"Bench Product {i}",
+            prod_cate_no=random.choice(leaves),
+            prod_cost_price=random.randint(1, 500),
+            prod_retail_price=random.randint(500, 1000),
+            prod_sell_zone="1",
+            prod_outer_quantity=random.randint(1, 4),
+            prod_inner_quantity=random.randint(1, 6),
+            prod_mfr_id=random.choice(mfrs),
+        )
+        for i in range(nums)
+    )
+    for batch in batched(prods):
+        Prod.objects.bulk_create(batch)
+
+    start = timezone.localdate() - timezone.timedelta(days=1)
+    group_rules = min(rules // 10, len(categories) + len(mfrs))
+    prod_nos = Prod.objects.values_list("prod_no", flat=True)
+    targets = random.sample(list(prod_nos), min(rules - group_rules, nums))
+    order_rules = [
+        OrderRule(
+            or_type=OrderRuleTypeChoices.Product,
+            or_prod_no_id=prod_no,
+            or_cannot_order=random.random() < 0.01,
+            or_shipped_as_case=random.random() < 0.3,
+            or_order_cases_quantity=random.choice([None, 1, 2]),
+            or_effective_start_date=start,
+        )
+        for prod_no in targets
+    ]
+    group_targets = random.sample(
+        [(OrderRuleTypeChoices.ProductCategory, c) for c in categories]
+        + [(OrderRuleTypeChoices.Manufacturer, m) for m in mfrs],
+        group_rules,
+    )
+    for or_type, target in group_targets:
+        field = (
+            "or_prod_cate_no"
+            if or_type == OrderRuleTypeChoices.ProductCategory
+            else "or_mfr_id"
+        )
+        order_rules.append(
+            OrderRule(
+                or_type=or_type,
+                or_order_price=random.choice([None, 1000, 5000]),
+                or_effective_start_date=start,
+                **{field: target},
+            )
+        )
+    OrderRule.objects.bulk_create(order_rules, batch_size=BATCH_SIZE)
+    bump_rule_version()
+    rule_snapshots.invalidate()
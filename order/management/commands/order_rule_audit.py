@@ -0,0 +1,61 @@
+import heapq
+from typing import Any, Iterator, Tuple
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from order.models import RULE_TARGET_FIELDS, OrderRule, OrderRuleTypeChoices
+
+
+class Command(BaseCommand):
+    help = "find order rules whose effective date ranges overlap"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--fail",
+            action="store_true",
+            help="exit with an error when overlapping rules are found",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> str | None:
+        self.stdout.write("auditing order rules...")
+        overlaps = 0
+        for or_type, target_pk, rule_pk, other_pk in find_overlapping_rules():
+            overlaps += 1
+            self.stdout.write(
+                f"{OrderRuleTypeChoices(or_type).label} {target_pk}: "
+                f"rule {rule_pk} overlaps rule {other_pk}"
+            )
+        self.stdout.write(f"{overlaps} overlapping rule pairs found")
+        if overlaps and options["fail"]:
+            raise CommandError("overlapping order rules found")
+
+
+def find_overlapping_rules() -> Iterator[Tuple[int, Any, int, int]]:
+    """
+    Sweep the rules of every target in start date order, keeping the rules
+    still in effect in a heap ordered by end date. Rules ending before a rule
+    starts are popped, every rule left overlaps it.
+    """
+    for or_type, target_field in RULE_TARGET_FIELDS.items():
+        rules = (
+            OrderRule.objects.filter(
+                or_type=or_type, **{f"{target_field}__isnull": False}
+            )
+            .order_by(target_field, "or_effective_start_date", "or_effective_end_date")
+            .values_list(
+                target_field,
+                "or_id",
+                "or_effective_start_date",
+                "or_effective_end_date",
+            )
+        )
+        current_target, active = None, []
+        for target_pk, rule_pk, start, end in rules.iterator():
+            if target_pk != current_target:
+                current_target, active = target_pk, []
+            while active and active[0][0] < start:
+                heapq.heappop(active)
+            for _end, other_pk in sorted(active, key=lambda rule: rule[1]):
+                yield or_type, target_pk, other_pk, rule_pk
+            heapq.heappush(active, (end, rule_pk))
@@ -0,0 +1,34 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from order.models import Order
+from utils.order import refresh_order_search
+
+
+class Command(BaseCommand):
+    help = "rebuild the order search rows of every order"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="orders refreshed at a time"
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> str | None:
+        batch_size = options["batch_size"]
+        last_no, total = None, 0
+        while True:
+            # keyset over the order numbers, each batch is its own transaction
+            orders = Order.objects.order_by("od_no")
+            if last_no is not None:
+                orders = orders.filter(od_no__gt=last_no)
+            od_nos = list(orders.values_list("od_no", flat=True)[:batch_size])
+            if not od_nos:
+                break
+            with transaction.atomic():
+                refresh_order_search(od_nos)
+            last_no, total = od_nos[-1], total + len(od_nos)
+            self.stdout.write(f"{total} orders refreshed")
+        self.stdout.write(f"order search rebuilt, {total} orders")
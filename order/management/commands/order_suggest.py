@@ -0,0 +1,134 @@
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from order.models import OrderProd, ReplenishmentSuggestion, StatusChoices
+from prod.models import Prod
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = "compute the suggested order quantity of every product from its history"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--window", type=int, default=28, help="days of history averaged"
+        )
+        parser.add_argument(
+            "--cover-days", type=int, default=14, help="days of demand to stock"
+        )
+        parser.add_argument(
+            "--safety",
+            type=float,
+            default=1.0,
+            help="standard deviations of daily demand kept as safety stock",
+        )
+        return super().add_arguments(parser)
+
+    def handle(self, *args: Any, **options: Any) -> str | None:
+        self.stdout.write("computing replenishment suggestions...")
+        suggestions = compute_suggestions(
+            timezone.localdate(),
+            options["window"],
+            options["cover_days"],
+            options["safety"],
+        )
+        save_suggestions(suggestions)
+        self.stdout.write(f"{len(suggestions)} suggestions saved")
+
+
+def load_daily_demand(today, window: int) -> pd.DataFrame:
+    """Ordered quantity of each product on the days it was ordered in the window."""
+    start = today - timezone.timedelta(days=window)
+    rows = (
+        OrderProd.objects.exclude(op_status=StatusChoices.Cancelled)
+        .filter(op_prod_no__isnull=False)
+        .annotate(day=TruncDate("op_od_no__od_date"))
+        .filter(day__gte=start, day__lt=today)
+        .values("op_prod_no", "day")
+        .annotate(quantity=Sum("op_quantity"))
+        .values_list("op_prod_no", "day", "quantity")
+    )
+    return pd.DataFrame.from_records(list(rows), columns=["prod_no", "day", "quantity"])
+
+
+def load_products(prod_nos: list):
+    """Stock and case sizes of the products, read ``BATCH_SIZE`` at a time."""
+    for start in range(0, len(prod_nos), BATCH_SIZE):
+        yield from Prod.objects.filter(
+            prod_no__in=prod_nos[start : start + BATCH_SIZE]
+        ).values_list(
+            "prod_no", "prod_quantity", "prod_outer_quantity", "prod_inner_quantity"
+        )
+
+
+def compute_suggestions(
+    today, window: int, cover_days: int, safety: float
+) -> pd.DataFrame:
+    """
+    Suggested order quantity of every product with demand in the window.
+
+    The trailing window mean and standard deviation of the daily demand are
+    computed from per product sums of the daily totals and their squares, days
+    without orders counting as zero. The stock target covers ``cover_days`` of
+    mean demand plus ``safety`` standard deviations, and the missing quantity
+    is rounded up to whole cases.
+    """
+    daily = load_daily_demand(today, window)
+    if daily.empty:
+        return pd.DataFrame(columns=["prod_no", "daily_demand", "suggested_quantity"])
+
+    daily["quantity_sq"] = daily["quantity"].astype(float) ** 2
+    sums = daily.groupby("prod_no")[["quantity", "quantity_sq"]].sum()
+    mean = sums["quantity"] / window
+    std = np.sqrt(np.maximum(sums["quantity_sq"] / window - mean**2, 0))
+
+    prods = pd.DataFrame.from_records(
+        list(load_products(sums.index.tolist())),
+        columns=["prod_no", "stock", "outer", "inner"],
+    ).set_index("prod_no")
+    prods = prods.join(mean.rename("daily_demand")).join(std.rename("std"))
+
+    target = prods["daily_demand"] * cover_days + safety * prods["std"] * np.sqrt(
+        cover_days
+    )
+    need = np.maximum(target - prods["stock"], 0)
+    case_size = np.maximum(prods["outer"] * prods["inner"], 1)
+    prods["suggested_quantity"] = (np.ceil(need / case_size) * case_size).astype(int)
+    return prods[["daily_demand", "suggested_quantity"]].reset_index()
+
+
+def save_suggestions(suggestions: pd.DataFrame) -> None:
+    """Replace the stored suggestions, products without demand are dropped."""
+    now = timezone.now()
+    with transaction.atomic():
+        ReplenishmentSuggestion.objects.bulk_create(
+            [
+                ReplenishmentSuggestion(
+                    rs_prod_no_id=prod_no,
+                    rs_daily_demand=daily_demand,
+                    rs_suggested_quantity=suggested_quantity,
+                    rs_computed_at=now,
+                )
+                for prod_no, daily_demand, suggested_quantity in suggestions[
+                    ["prod_no", "daily_demand", "suggested_quantity"]
+                ].itertuples(index=False)
+            ],
+            batch_size=BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["rs_prod_no"],
+            update_fields=[
+                "rs_daily_demand",
+                "rs_suggested_quantity",
+                "rs_computed_at",
+            ],
+        )
+        # every row upserted above carries this run's timestamp
+        ReplenishmentSuggestion.objects.filter(rs_computed_at__lt=now).delete()
@@ -13,7 +13,7 @@ from order.models import (
     StatusChoices,
     WarehouseStorageFeeRecipientChoices,
 )
-from utils.order import get_order_no_from_day
+from utils.order import reserve_order_nos
 
 faker = Faker()
 MODE_REFRESH = "refresh"
@@ -52,7 +52,7 @@ def run_seed(mode: str, nums: int = 10):
             days=np.random.randint(0, (end_date - start_date).days)
         )
 
-        od_no = get_order_no_from_day(random_date) + 1
+        [od_no] = reserve_order_nos(day=timezone.localdate(random_date))
         od_has_contact_form = np.random.choice([True, False], p=[0.2, 0.8])
 
         od = Order.objects.create(
@@ -0,0 +1,15 @@
+from utils.order import rule_version_checked
+
+
+class OrderRuleVersionMiddleware:
+    """Read the shared order rule version at most once per request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = rule_version_checked.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            rule_version_checked.reset(token)
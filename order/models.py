@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -86,6 +88,14 @@ class OrderRuleTypeChoices(models.IntegerChoices):
     ProductCategory = 2, _("商品類別")
 
 
+# the foreign key holding the target of each rule type
+RULE_TARGET_FIELDS = {
+    OrderRuleTypeChoices.Product: "or_prod_no",
+    OrderRuleTypeChoices.Manufacturer: "or_mfr_id",
+    OrderRuleTypeChoices.ProductCategory: "or_prod_cate_no",
+}
+
+
 class OrderRule(models.Model):
     or_id = models.BigAutoField(primary_key=True, verbose_name=_("訂單規則 ID"))
     or_type = models.PositiveSmallIntegerField(
@@ -140,6 +150,51 @@ class OrderRule(models.Model):
         default=timezone.make_aware(timezone.datetime(9999, 1, 1)),
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=[
+                    "or_type",
+                    target_field,
+                    "or_effective_start_date",
+                    "or_effective_end_date",
+                ],
+                name=f"{target_field}_dates_idx",
+            )
+            for target_field in RULE_TARGET_FIELDS.values()
+        ]
+
+    def get_target_pk(self):
+        target_field = RULE_TARGET_FIELDS.get(self.or_type)
+        if target_field is None:
+            return None
+        return getattr(self, f"{target_field}_id")
+
+    def get_overlapping_rules(self):
+        """Rules of the same type and target whose effective range overlaps."""
+        return OrderRule.objects.filter(
+            or_type=self.or_type,
+            **{RULE_TARGET_FIELDS[self.or_type]: self.get_target_pk()},
+            or_effective_start_date__lte=self.or_effective_end_date,
+            or_effective_end_date__gte=self.or_effective_start_date,
+        ).exclude(pk=self.pk)
+
+    def clean(self):
+        start, end = self.or_effective_start_date, self.or_effective_end_date
+        if start is None or end is None or self.get_target_pk() is None:
+            return
+        if start > end:
+            raise ValidationError(
+                _("訂單規則生效起日應早於生效迄日。"), code="invalid_effective_dates"
+            )
+        overlaps = list(self.get_overlapping_rules()[:5])
+        if overlaps:
+            raise ValidationError(
+                _("訂單規則生效期間與其他規則重疊：%(rules)s"),
+                code="overlapping_rules",
+                params={"rules": ", ".join(str(rule.pk) for rule in overlaps)},
+            )
+
     def __str__(self):
         attrs = []
         attrs.append(f"type: {OrderRuleTypeChoices(self.or_type).label}")
@@ -162,3 +217,128 @@ class OrderRule(models.Model):
             attrs.append(f"notes: {self.or_notes}")
 
         return f"rule ({self.pk}) {", ".join(attrs)}"
+
+
+class OrderRuleVersion(models.Model):
+    orv_id = models.PositiveSmallIntegerField(
+        primary_key=True, verbose_name=_("訂單規則版本 ID")
+    )
+    orv_version = models.PositiveBigIntegerField(
+        verbose_name=_("訂單規則版本"), default=0
+    )
+
+    def __str__(self):
+        return f"{self.orv_version}"
+
+
+class OrderNoSequence(models.Model):
+    ons_day = models.DateField(primary_key=True, verbose_name=_("訂單編號日期"))
+    ons_last_no = models.PositiveIntegerField(
+        verbose_name=_("訂單編號當日最後序號"), default=0
+    )
+
+    def __str__(self):
+        return f"{self.ons_day}: {self.ons_last_no}"
+
+
+class Checklist(models.Model):
+    """A line a user checked on the circulated order page of a manufacturer."""
+
+    cl_id = models.BigAutoField(primary_key=True, verbose_name=_("勾選清單 ID"))
+    cl_user_id = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        verbose_name=_("勾選清單使用者"),
+        on_delete=models.CASCADE,
+    )
+    cl_mfr_full_id = models.CharField(
+        verbose_name=_("勾選清單廠商編號"), max_length=10
+    )
+    cl_prod_no = models.ForeignKey(
+        to=Prod, verbose_name=_("勾選清單商品編號"), on_delete=models.CASCADE
+    )
+    cl_order_quantity = models.PositiveBigIntegerField(
+        verbose_name=_("勾選清單訂貨數量"), default=0
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["cl_user_id", "cl_mfr_full_id", "cl_prod_no"],
+                name="unique_checklist_prod",
+            )
+        ]
+
+
+class ReplenishmentSuggestion(models.Model):
+    """The suggested order quantity of a product, computed by order_suggest."""
+
+    rs_prod_no = models.OneToOneField(
+        to=Prod,
+        primary_key=True,
+        verbose_name=_("建議商品編號"),
+        on_delete=models.CASCADE,
+        related_name="suggestion",
+    )
+    rs_daily_demand = models.FloatField(verbose_name=_("建議平均日訂貨量"), default=0)
+    rs_suggested_quantity = models.PositiveBigIntegerField(
+        verbose_name=_("建議訂貨數量"), default=0
+    )
+    rs_computed_at = models.DateTimeField(verbose_name=_("建議計算時間"))
+
+    def __str__(self):
+        return f"{self.rs_prod_no_id}: {self.rs_suggested_quantity}"
+
+
+class OrderSearch(models.Model):
+    """
+    One row per order with the columns the order list filters on.
+
+    Kept in sync with the orders and their buyers by ``order.signals`` and
+    ``utils.order.refresh_order_search``; each index ends with the order
+    number so a filter resolves the matching orders from the index alone.
+    """
+
+    os_od_no = models.OneToOneField(
+        to=Order,
+        primary_key=True,
+        verbose_name=_("查詢訂單編號"),
+        on_delete=models.CASCADE,
+        related_name="search",
+    )
+    os_user_id = models.ForeignKey(
+        to=settings.AUTH_USER_MODEL,
+        verbose_name=_("查詢訂貨人員"),
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="+",
+    )
+    os_mfr_id = models.ForeignKey(
+        to=Manufacturer,
+        verbose_name=_("查詢廠商 ID"),
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="+",
+    )
+    os_date = models.DateTimeField(verbose_name=_("查詢訂單下訂日期"))
+    os_except_arrival_date = models.DateField(verbose_name=_("查詢預期到貨日期"))
+    os_notes = models.TextField(verbose_name=_("查詢訂單備註"), blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["os_user_id", "os_date", "os_od_no"],
+                name="order_search_user_date",
+            ),
+            models.Index(
+                fields=["os_mfr_id", "os_date", "os_od_no"],
+                name="order_search_mfr_date",
+            ),
+            models.Index(fields=["os_date", "os_od_no"], name="order_search_date"),
+            models.Index(
+                fields=["os_except_arrival_date", "os_od_no"],
+                name="order_search_arrival",
+            ),
+        ]
+
+    def __str__(self):
+        return str(self.os_od_no_id)
@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from manufacturer.models import Manufacturer
+from prod.models import ProdCategory
+from utils.order import bump_rule_version, refresh_order_search, rule_snapshots
+
+from .models import Order, OrderRule, OrderSearch
+
+
+@receiver([post_save, post_delete], sender=OrderRule)
+@receiver([post_save, post_delete], sender=ProdCategory)
+def invalidate_rule_snapshot(sender, **kwargs):
+    # after the commit, or another request could snapshot an uncommitted rule
+    # under a version a rollback would hand out again
+    transaction.on_commit(invalidate_after_commit)
+
+
+def invalidate_after_commit():
+    bump_rule_version()
+    rule_snapshots.invalidate()
+
+
+@receiver(post_save, sender=Order)
+def refresh_order_search_of_order(sender, instance, **kwargs):
+    refresh_order_search([instance.od_no])
+
+
+@receiver(post_save, sender=Manufacturer)
+def update_order_search_buyer(sender, instance, created, **kwargs):
+    if not created:
+        OrderSearch.objects.filter(os_mfr_id=instance).update(
+            os_user_id=instance.mfr_user_id
+        )
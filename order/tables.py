@@ -1,5 +1,6 @@
 import django_tables2 as tables
-from django.db.models import Case, F, QuerySet, Value, When
+from django.db.models import Exists, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils import timezone
@@ -8,8 +9,9 @@ from django.utils.translation import gettext_lazy as _
 
 from manufacturer.models import Manufacturer
 from prod.models import Prod
+from utils.order import get_checklist, get_checklists
 
-from .models import Order, OrderRule, OrderRuleTypeChoices
+from .models import Checklist, Order, OrderRule, OrderRuleTypeChoices
 
 
 class OrderTable(tables.Table):
@@ -50,7 +52,7 @@ class OrderTable(tables.Table):
         return format_html("".join(inputs))
 
     # def render_od_mfr_id(self, value):
-    #     return format_html(f"{value.mfr_full_id}<br>{value.mfr_name}")
+    #     return format_html("{}<br>{}", value.mfr_full_id, value.mfr_name)
 
     def render_od_selected(self, value):
         return format_html(
@@ -182,10 +184,16 @@ class OrderRulesTable(tables.Table):
 
 
 class SummingColums(tables.Column):
+    def __init__(self, *args, total: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        # key of the column in the table totals
+        self.total = total
+
     def render_footer(self, bound_column, table):
+        value = table.totals.get(self.total, 0)
         return format_html(
             f"""
-            <input type='number' class="form-control-plaintext" value='0' field='{bound_column.name}'/>"""
+            <input type='number' class="form-control-plaintext" value='{value}' field='{bound_column.name}'/>"""
         )
 
 
@@ -201,8 +209,17 @@ class CirculatedOrderTable(tables.Table):
     )
 
     co_func = tables.Column(verbose_name="功能", empty_values=(), footer="合計")
-    co_total_quantity = tables.Column(
-        verbose_name="庫存合計", empty_values=(), orderable=False
+    co_mfr = tables.Column(
+        verbose_name="廠商", accessor="prod_mfr_id", orderable=False
+    )
+    co_total_quantity = SummingColums(
+        verbose_name="庫存合計",
+        empty_values=(),
+        orderable=False,
+        total="total_quantity",
+    )
+    co_suggested_quantity = tables.Column(
+        verbose_name="建議訂貨數量", empty_values=(), orderable=False
     )
     co_order_quantity = tables.Column(
         verbose_name="訂貨數量", empty_values=(), orderable=True
@@ -211,18 +228,55 @@ class CirculatedOrderTable(tables.Table):
         verbose_name="收縮 / 箱入數", empty_values=(), orderable=False
     )
     co_order_box_quantity = SummingColums(
-        verbose_name="訂貨箱數", empty_values=(), orderable=False
+        verbose_name="訂貨箱數",
+        empty_values=(),
+        orderable=False,
+        total="order_box_quantity",
     )
     co_order_cost_price = SummingColums(
-        verbose_name="訂貨未稅金額", empty_values=(), orderable=False
+        verbose_name="訂貨未稅金額",
+        empty_values=(),
+        orderable=False,
+        total="order_cost_price",
     )
     co_prod_cost_price = tables.Column(
         verbose_name="商品未稅金額", empty_values=(), orderable=False
     )
 
+    def __init__(self, *args, totals=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # checklist of each manufacturer, read by the renderers; the sort hooks
+        # join the Checklist table instead
+        self.checklists = dict()
+        # manufacturer totals of all pages, from get_checklist_totals
+        self.totals = totals or dict()
+
+    def get_checklist(self, mfr_full_id: str) -> dict:
+        """
+        The checked products of the current user, prod_no -> quantity.
+
+        The checklist is read once per table and manufacturer, every row
+        renderer then only does a dict lookup.
+        """
+        if mfr_full_id not in self.checklists:
+            user = self.request.user
+            self.checklists[mfr_full_id] = (
+                get_checklist(user, mfr_full_id) if user.is_authenticated else {}
+            )
+        return self.checklists[mfr_full_id]
+
+    def load_checklists(self, mfr_full_ids) -> None:
+        """Read the checklists of several manufacturers at once."""
+        user = self.request.user
+        if user.is_authenticated:
+            self.checklists.update(get_checklists(user, list(mfr_full_ids)))
+
     def render_co_feedback(self, record):
         return format_html("<div field='feedback'></div>")
 
+    def render_co_mfr(self, value):
+        return format_html("{}<br>{}", value.mfr_full_id, value.mfr_name)
+
     def render_co_prod_cost_price(self, record, value):
         return format_html(
             f"""
@@ -257,18 +311,23 @@ class CirculatedOrderTable(tables.Table):
         )
 
     def render_co_order_quantity(self, record, value):
-        request = self.request
-        order_quantity = 0
-        if "checklist" in request.session:
-            [[_, checklist]] = request.session.get("checklist")
-            checklist_dict = {c["prod_no"]: c["order_quantity"] for c in checklist}
-            order_quantity = checklist_dict.get(record.prod_no, 0)
+        checklist = self.get_checklist(record.prod_mfr_id.mfr_full_id)
+        order_quantity = checklist.get(record.prod_no, 0)
 
         return format_html(
             f"""
             <input type="number" class="form-control" value="{order_quantity}" field="order-quantity"/>"""
         )
 
+    def render_co_suggested_quantity(self, record):
+        # precomputed by the order_suggest command, read with the products
+        suggestion = getattr(record, "suggestion", None)
+        suggested_quantity = suggestion.rs_suggested_quantity if suggestion else 0
+        return format_html(
+            f"""
+            <input type="number" readonly class="form-control-plaintext" value="{suggested_quantity}" field="suggested-quantity"/>"""
+        )
+
     def render_prod_quantity(self, record, value):
         return format_html(
             f"""
@@ -276,60 +335,42 @@ class CirculatedOrderTable(tables.Table):
         )
 
     def render_co_func(self, record):
-        request = self.request
-        checked = ""
-        if "checklist" in request.session:
-            # TODO: why is it nested?
-            [[_, checklist]] = request.session.get("checklist")
-            checklist_prod_no_list = [c["prod_no"] for c in checklist]
-            checked = "checked" if record.prod_no in checklist_prod_no_list else checked
+        checklist = self.get_checklist(record.prod_mfr_id.mfr_full_id)
+        checked = "checked" if record.prod_no in checklist else ""
         return format_html(
             f"""
             <input class="form-check-input form-control" type="checkbox" value="" {checked}>"""
         )
 
-    def order_co_func(self, queryset: QuerySet, is_descending):
-        request = self.request
-        if "checklist" in request.session and queryset.exists():
-            [checklist_tuple] = request.session.get("checklist")
-            mfr_full_id, checklist = checklist_tuple
-            checklist_prod_no_list = [c["prod_no"] for c in checklist]
-            if mfr_full_id == queryset.first().prod_mfr_id.mfr_full_id:
-                queryset = queryset.order_by(
-                    Case(
-                        When(
-                            prod_no__in=checklist_prod_no_list,
-                            then=1 if is_descending else 0,
-                        ),
-                        default=0 if is_descending else 1,
-                    )
-                )
+    def get_checklist_lines(self) -> QuerySet:
+        """The checklist line of the current user for each product of the query."""
+        return Checklist.objects.filter(
+            cl_user_id=self.request.user,
+            cl_mfr_full_id=OuterRef("prod_mfr_id__mfr_full_id"),
+            cl_prod_no=OuterRef("prod_no"),
+        )
 
-            else:
-                pass
+    def order_co_func(self, queryset: QuerySet, is_descending):
+        if self.request.user.is_authenticated:
+            # checked products first, sorted in the database against the
+            # checklist table so the statement does not grow with the checklist
+            queryset = queryset.annotate(
+                co_checked=Exists(self.get_checklist_lines())
+            ).order_by("co_checked" if is_descending else "-co_checked")
 
         return (queryset, True)
 
     def order_co_order_quantity(self, queryset: QuerySet, is_descending):
-        request = self.request
-        if "checklist" in request.session and queryset.exists():
-            [checklist_tuple] = request.session.get("checklist")
-            _, checklist = checklist_tuple
-            queryset = queryset.order_by(
-                Case(
-                    *[
-                        When(
-                            prod_no=c["prod_no"],
-                            then=(
-                                -Value(c["order_quantity"])
-                                if is_descending
-                                else Value(c["order_quantity"])
-                            ),
-                        )
-                        for c in checklist
-                    ],
-                    default=0,
+        if self.request.user.is_authenticated:
+            queryset = queryset.annotate(
+                co_checklist_quantity=Coalesce(
+                    Subquery(
+                        self.get_checklist_lines().values("cl_order_quantity")[:1]
+                    ),
+                    0,
                 )
+            ).order_by(
+                "-co_checklist_quantity" if is_descending else "co_checklist_quantity"
             )
 
         return (queryset, True)
@@ -339,9 +380,13 @@ class CirculatedOrderTable(tables.Table):
         fields = [
             "co_feedback",
             "co_func",
+            "co_mfr",
             "prod_no",
             "prod_name",
             "prod_quantity",
         ]
         per_page = 10
-        row_attrs = {"data-id": lambda record: record.pk}
+        row_attrs = {
+            "data-id": lambda record: record.pk,
+            "data-mfr-full-id": lambda record: record.prod_mfr_id.mfr_full_id,
+        }
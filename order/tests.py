@@ -1,3 +1,997 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import date
+from io import StringIO
 
-# Create your tests here.
+from constance.test import override_config
+from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django_tables2 import RequestConfig
+
+from manufacturer.models import Manufacturer
+from order.models import (
+    Checklist,
+    Order,
+    OrderNoSequence,
+    OrderProd,
+    OrderRule,
+    OrderRuleTypeChoices,
+    OrderSearch,
+    ReplenishmentSuggestion,
+    StatusChoices,
+)
+from order.tables import CirculatedOrderTable, SummingColums
+from order.filters import OrderFilter
+from order.views import (
+    OrderCirculatedOrderView,
+    OrderCreateMultipleView,
+    OrderNoAutocomplete,
+)
+from prod.models import CateTypeChoices, Prod, ProdCategory
+from utils.order import (
+    OrderProdSchema,
+    bump_rule_version,
+    check_product_lines,
+    get_checklist,
+    get_rule,
+    get_rule_snapshot,
+    iter_validate_order,
+    peek_order_nos,
+    reserve_order_nos,
+    rule_snapshots,
+    rule_version_checked,
+    validate_order,
+)
+
+
+class OrderRuleTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.mfr = Manufacturer.objects.create(
+            mfr_main_id="12345678",
+            mfr_sub_id="01",
+            mfr_name="test mfr",
+            mfr_address="test address",
+        )
+        cls.cate = ProdCategory.objects.create(
+            cate_no="000001", cate_name="LLA", cate_type=CateTypeChoices.Cate
+        )
+        cls.subcate = ProdCategory.objects.create(
+            cate_no="000101", cate_name="LLAMMA", cate_type=CateTypeChoices.SubCate
+        )
+        cls.subsubcate = ProdCategory.objects.create(
+            cate_no="010101",
+            cate_name="LLAMMA-000001",
+            cate_type=CateTypeChoices.SubSubCate,
+        )
+        cls.prods = [
+            Prod.objects.create(
+                prod_name=f"prod {i}",
+                prod_cate_no=cls.subsubcate,
+                prod_cost_price=10,
+                prod_retail_price=20,
+                prod_sell_zone="1",
+                prod_outer_quantity=2,
+                prod_inner_quantity=5,
+                prod_mfr_id=cls.mfr,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        rule_snapshots.invalidate()
+
+    def create_rule(self, **kwargs):
+        kwargs.setdefault(
+            "or_effective_start_date",
+            timezone.localdate() - timezone.timedelta(days=1),
+        )
+        return OrderRule.objects.create(**kwargs)
+
+
+class RuleSnapshotTest(OrderRuleTestMixin, TestCase):
+    def test_rule_lookup_is_cached(self):
+        prod = self.prods[0]
+        self.create_rule(or_type=OrderRuleTypeChoices.Product, or_prod_no=prod)
+        # one query for the version, one for the rules, one for the categories
+        with self.assertNumQueries(3):
+            snapshot = get_rule_snapshot()
+        with self.assertNumQueries(0):
+            for prod in self.prods:
+                get_rule(prod, OrderRuleTypeChoices.Product, snapshot)
+                get_rule(self.mfr, OrderRuleTypeChoices.Manufacturer, snapshot)
+        self.assertEqual(len(get_rule(self.prods[0], OrderRuleTypeChoices.Product)), 1)
+
+    def test_version_is_checked_once_per_request(self):
+        get_rule_snapshot()
+        token = rule_version_checked.set(False)
+        try:
+            with self.assertNumQueries(1):
+                get_rule_snapshot()
+                get_rule_snapshot()
+        finally:
+            rule_version_checked.reset(token)
+
+    def test_snapshot_is_rebuilt_when_version_changes(self):
+        snapshot = get_rule_snapshot()
+        # a rule written by another worker: no local signal, only the version bump
+        OrderRule.objects.bulk_create(
+            [OrderRule(or_type=OrderRuleTypeChoices.Manufacturer, or_mfr_id=self.mfr)]
+        )
+        self.assertIs(get_rule_snapshot(), snapshot)
+        bump_rule_version()
+        self.assertIsNot(get_rule_snapshot(), snapshot)
+        self.assertEqual(len(get_rule(self.mfr, OrderRuleTypeChoices.Manufacturer)), 1)
+
+    def test_snapshot_refreshes_on_save_and_delete(self):
+        self.assertEqual(get_rule(self.mfr, OrderRuleTypeChoices.Manufacturer), ())
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = self.create_rule(
+                or_type=OrderRuleTypeChoices.Manufacturer,
+                or_mfr_id=self.mfr,
+                or_order_price=1000,
+            )
+            # not refreshed before the commit
+            self.assertEqual(get_rule(self.mfr, OrderRuleTypeChoices.Manufacturer), ())
+        self.assertEqual(get_rule(self.mfr, OrderRuleTypeChoices.Manufacturer), (rule,))
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.delete()
+        self.assertEqual(get_rule(self.mfr, OrderRuleTypeChoices.Manufacturer), ())
+
+    def test_inactive_rule_is_ignored(self):
+        OrderRule.objects.create(
+            or_type=OrderRuleTypeChoices.Manufacturer,
+            or_mfr_id=self.mfr,
+            or_cannot_order=True,
+            or_effective_start_date=timezone.localdate() + timezone.timedelta(days=1),
+        )
+        self.assertEqual(get_rule(self.mfr, OrderRuleTypeChoices.Manufacturer), ())
+
+    def test_rules_as_of_date(self):
+        today = timezone.localdate()
+        days = [today + timezone.timedelta(days=i) for i in range(-10, 11, 5)]
+        # [-10, 10], [-5, -5] and [0, 5]
+        rules = [
+            self.create_rule(
+                or_type=OrderRuleTypeChoices.Manufacturer,
+                or_mfr_id=self.mfr,
+                or_effective_start_date=start,
+                or_effective_end_date=end,
+            )
+            for start, end in [
+                (days[0], days[4]),
+                (days[1], days[1]),
+                (days[2], days[3]),
+            ]
+        ]
+        snapshot = get_rule_snapshot()
+        for day, expected in [
+            (days[0] - timezone.timedelta(days=1), []),
+            (days[1], rules[:2]),
+            (days[2], [rules[0], rules[2]]),
+            (days[4], rules[:1]),
+            (days[4] + timezone.timedelta(days=1), []),
+        ]:
+            self.assertEqual(
+                get_rule(
+                    self.mfr, OrderRuleTypeChoices.Manufacturer, snapshot.as_of(day)
+                ),
+                tuple(expected),
+            )
+
+
+class ValidateOrderTest(OrderRuleTestMixin, TestCase):
+    def test_manufacturer_price_rule(self):
+        self.create_rule(
+            or_type=OrderRuleTypeChoices.Manufacturer,
+            or_mfr_id=self.mfr,
+            or_order_price=1000,
+        )
+        data = [OrderProdSchema(prod.prod_no, 10) for prod in self.prods]
+        error_list, mfr_prod_dict = validate_order(data)
+        self.assertEqual([e["code"] for e in error_list], ["order_price_too_low"])
+        self.assertEqual(len(mfr_prod_dict[self.mfr]), 3)
+
+    def test_product_rules(self):
+        self.create_rule(
+            or_type=OrderRuleTypeChoices.Product,
+            or_prod_no=self.prods[0],
+            or_shipped_as_case=True,
+            or_order_cases_quantity=2,
+        )
+        self.create_rule(
+            or_type=OrderRuleTypeChoices.Product,
+            or_prod_no=self.prods[1],
+            or_cannot_order=True,
+        )
+        data = [
+            OrderProdSchema(self.prods[0].prod_no, 15),
+            OrderProdSchema(self.prods[1].prod_no, 10),
+            OrderProdSchema(self.prods[2].prod_no, 10),
+        ]
+        error_list, _ = validate_order(data)
+        self.assertEqual(
+            [e["code"] for e in error_list],
+            ["not_as_case", "order_quantity_too_low", "cannot_order"],
+        )
+
+    def test_future_rule_applies_as_of_its_start_date(self):
+        tomorrow = timezone.localdate() + timezone.timedelta(days=1)
+        OrderRule.objects.create(
+            or_type=OrderRuleTypeChoices.Product,
+            or_prod_no=self.prods[0],
+            or_cannot_order=True,
+            or_effective_start_date=tomorrow,
+        )
+        data = [OrderProdSchema(self.prods[0].prod_no, 10)]
+        self.assertEqual(validate_order(data)[0], [])
+        error_list, _ = validate_order(data, as_of=tomorrow)
+        self.assertEqual([e["code"] for e in error_list], ["cannot_order"])
+
+    def test_product_not_exist(self):
+        error_list, _ = validate_order([OrderProdSchema(999999, 1)])
+        self.assertEqual([e["code"] for e in error_list], ["product_not_exist"])
+
+    def test_products_are_resolved_in_one_query(self):
+        data = [OrderProdSchema(prod.prod_no, 10) for prod in self.prods]
+        snapshot = get_rule_snapshot()
+        with self.assertNumQueries(1):
+            validate_order(data, snapshot=snapshot)
+
+    def test_vectorized_product_rules_match_per_line(self):
+        self.create_rule(
+            or_type=OrderRuleTypeChoices.Product,
+            or_prod_no=self.prods[0],
+            or_shipped_as_case=True,
+            or_order_price=500,
+        )
+        self.create_rule(
+            or_type=OrderRuleTypeChoices.Product,
+            or_prod_no=self.prods[1],
+            or_order_cases_quantity=3,
+        )
+        for quantities in [(15, 20, 0), (60, 30, 10), (10, 29, -1)]:
+            data = [
+                OrderProdSchema(prod.prod_no, quantity)
+                for prod, quantity in zip(self.prods, quantities)
+            ]
+            self.assertEqual(
+                validate_order(data, vectorized=True)[0],
+                validate_order(data, vectorized=False)[0],
+            )
+
+    def test_category_rules_roll_up_to_ancestors(self):
+        for cate in [self.subsubcate, self.subcate, self.cate]:
+            self.create_rule(
+                or_type=OrderRuleTypeChoices.ProductCategory,
+                or_prod_cate_no=cate,
+                or_order_price=250,
+            )
+        data = [OrderProdSchema(prod.prod_no, 10) for prod in self.prods[:2]]
+        error_list, _ = validate_order(data)
+        self.assertEqual(
+            [(e["code"], e["obj"]) for e in error_list],
+            [
+                ("order_price_too_low", str(cate))
+                for cate in [self.subsubcate, self.subcate, self.cate]
+            ],
+        )
+        data.append(OrderProdSchema(self.prods[2].prod_no, 10))
+        self.assertEqual(validate_order(data)[0], [])
+
+
+class StreamValidateOrderTest(OrderRuleTestMixin, TestCase):
+    def test_stream_line_and_group_results(self):
+        self.create_rule(
+            or_type=OrderRuleTypeChoices.Manufacturer,
+            or_mfr_id=self.mfr,
+            or_order_price=1000,
+        )
+        products = [
+            {"prod_no": prod.prod_no, "prod_quantity": 10} for prod in self.prods
+        ]
+        products.append({"prod_no": 999999, "prod_quantity": 1})
+        response = self.client.post(
+            reverse("api:stream_validate_order"),
+            {"products": products},
+            content_type="application/json",
+        )
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        records = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(
+            [(r["type"], r["obj"]) for r in records if r["errors"]],
+            [("line", 999999), ("group", str(self.mfr))],
+        )
+        self.assertEqual(len([r for r in records if r["type"] == "line"]), 4)
+
+    def test_repeated_product_lines_report_their_own_errors(self):
+        data = [
+            OrderProdSchema(self.prods[0].prod_no, 100),
+            OrderProdSchema(self.prods[0].prod_no, 0),
+            OrderProdSchema(999999, 1),
+        ]
+        records = [r for r in iter_validate_order(data) if r["type"] == "line"]
+        self.assertEqual(
+            [[e["code"] for e in r["errors"]] for r in records],
+            [[], ["quantity_too_low"], ["product_not_exist"]],
+        )
+        order_products = [(line, self.prods[0]) for line in data[:2]]
+        for vectorized in (False, True):
+            self.assertEqual(list(check_product_lines(order_products, vectorized)), [1])
+
+
+class CreateOrderTest(OrderRuleTestMixin, TestCase):
+    def post_create(self, products):
+        return self.client.post(
+            reverse("api:create_order"),
+            {"products": products, "action": "create"},
+            content_type="application/json",
+        )
+
+    def test_create_splits_lines_into_orders(self):
+        products = [
+            {"prod_no": prod.prod_no, "prod_quantity": 10} for prod in self.prods
+        ]
+        with override_config(ORDER_MAX_PRODUCTS=2):
+            response = self.post_create(products)
+        self.assertEqual(response.status_code, 200)
+        orders = Order.objects.order_by("od_no")
+        self.assertEqual([order.orderprod_set.count() for order in orders], [2, 1])
+        self.assertEqual(
+            response.json()["obj"], ", ".join(str(order.od_no) for order in orders)
+        )
+        self.assertEqual(OrderProd.objects.filter(op_quantity=10).count(), 3)
+
+    def test_create_writes_in_bulk(self):
+        products = [
+            {"prod_no": prod.prod_no, "prod_quantity": 10} for prod in self.prods
+        ]
+        reserve_order_nos()
+        with CaptureQueriesContext(connection) as queries:
+            self.post_create(products)
+        writes = [
+            q["sql"]
+            for q in queries
+            if q["sql"].startswith(("INSERT", "UPDATE")) and '"order_' in q["sql"]
+        ]
+        # the order number reservation and one insert per table, the search
+        # rows included
+        self.assertEqual(len(writes), 4, writes)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_create_is_checked_as_of_today(self):
+        OrderRule.objects.create(
+            or_type=OrderRuleTypeChoices.Product,
+            or_prod_no=self.prods[0],
+            or_cannot_order=True,
+            or_effective_start_date=timezone.localdate(),
+        )
+        products = [{"prod_no": self.prods[0].prod_no, "prod_quantity": 10}]
+        earlier = (timezone.localdate() - timezone.timedelta(days=10)).isoformat()
+        response = self.client.post(
+            reverse("api:create_order"),
+            {"products": products, "action": "validation", "as_of": earlier},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            reverse("api:create_order"),
+            {"products": products, "action": "create", "as_of": earlier},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["obj"], "as_of")
+        self.assertEqual(self.post_create(products).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class AsyncCreateOrderTest(OrderRuleTestMixin, TestCase):
+    async def test_async_validation(self):
+        response = await self.async_client.post(
+            reverse("api:async_create_order"),
+            {
+                "products": [{"prod_no": self.prods[0].prod_no, "prod_quantity": 0}],
+                "action": "validation",
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["errors"])
+
+
+class ChecklistTest(OrderRuleTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="buyer")
+        self.client.force_login(self.user)
+
+    def post(self, mfr_full_id, checklist=(), unchecklist=()):
+        return self.client.post(
+            reverse("api:update_checklist"),
+            {
+                "mfr_full_id": mfr_full_id,
+                "checklist": [
+                    {"prod_no": prod.prod_no, "order_quantity": quantity}
+                    for prod, quantity in checklist
+                ],
+                "unchecklist": [
+                    {"prod_no": prod.prod_no, "order_quantity": 0}
+                    for prod in unchecklist
+                ],
+            },
+            content_type="application/json",
+        )
+
+    def test_updates_apply_in_place(self):
+        first, second, third = self.prods
+        other = Manufacturer.objects.create(
+            mfr_main_id="87654321",
+            mfr_sub_id="01",
+            mfr_name="other mfr",
+            mfr_address="test address",
+        )
+        third.prod_mfr_id = other
+        third.save()
+        self.post("1234567801", [(first, 10), (second, 20)])
+        self.post("8765432101", [(third, 5)])
+        with CaptureQueriesContext(connection) as queries:
+            self.post("1234567801", [(second, 30)], [first])
+        # the session is only read for the login, never written
+        self.assertFalse(
+            [
+                q
+                for q in queries
+                if "django_session" in q["sql"] and not q["sql"].startswith("SELECT")
+            ]
+        )
+        self.assertEqual(get_checklist(self.user, "1234567801"), {second.prod_no: 30})
+        self.assertEqual(get_checklist(self.user, "8765432101"), {third.prod_no: 5})
+
+    def test_invalid_lines_are_rejected(self):
+        first, second, third = self.prods
+        response = self.post("1234567801", [(first, -1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "invalid_quantity")
+
+        response = self.post("8765432101", [(first, 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "product_not_exist")
+
+        response = self.client.post(
+            reverse("api:update_checklist"),
+            {
+                "mfr_full_id": "1234567801",
+                "checklist": [{"prod_no": 999999, "order_quantity": 1}],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["obj"], 999999)
+        self.assertFalse(Checklist.objects.exists())
+
+    def test_table_reads_the_checklist_once(self):
+        self.post(self.mfr.mfr_full_id, [(self.prods[0], 10), (self.prods[2], 30)])
+        request = RequestFactory().get("/")
+        request.user = self.user
+        table = CirculatedOrderTable(self.mfr.prod_set.order_by("prod_no"))
+        RequestConfig(request).configure(table)
+        with CaptureQueriesContext(connection) as queries:
+            cells = [
+                (row.get_cell("co_func"), row.get_cell("co_order_quantity"))
+                for row in table.rows
+            ]
+        self.assertEqual(len([q for q in queries if "order_checklist" in q["sql"]]), 1)
+        self.assertEqual(
+            ["checked" in func for func, quantity in cells], [True, False, True]
+        )
+        self.assertIn('value="30"', cells[2][1])
+
+    def test_table_sorts_against_the_checklist(self):
+        first, second, third = self.prods
+        self.post(self.mfr.mfr_full_id, [(second, 10), (third, 30)])
+
+        def sorted_prod_nos(order_by):
+            request = RequestFactory().get("/", {"sort": order_by})
+            request.user = self.user
+            table = CirculatedOrderTable(self.mfr.prod_set.order_by("prod_no"))
+            RequestConfig(request).configure(table)
+            return [row.record.prod_no for row in table.rows]
+
+        self.assertEqual(
+            sorted_prod_nos("-co_order_quantity"),
+            [third.prod_no, second.prod_no, first.prod_no],
+        )
+        self.assertEqual(sorted_prod_nos("co_func")[-1], first.prod_no)
+        self.assertEqual(sorted_prod_nos("-co_func")[0], first.prod_no)
+
+    def test_totals_cover_every_product(self):
+        first, second, third = self.prods
+        third.prod_quantity = 7
+        third.save()
+        self.post(self.mfr.mfr_full_id, [(first, 10), (third, 30)])
+        self.post("other", [(second, 50)])
+        other = get_user_model().objects.create_user(username="other")
+        Checklist.objects.create(
+            cl_user_id=other,
+            cl_mfr_full_id=self.mfr.mfr_full_id,
+            cl_prod_no=second,
+            cl_order_quantity=20,
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("api:checklist_totals"),
+                {"mfr_full_id": self.mfr.mfr_full_id},
+            )
+        self.assertEqual(len([q for q in queries if "prod_prod" in q["sql"]]), 1)
+        totals = {
+            "order_box_quantity": 4,
+            "order_cost_price": 400,
+            "total_quantity": 47,
+        }
+        self.assertEqual(response.json(), totals)
+
+        # the footers show the totals even when a page holds a single row
+        request = RequestFactory().get("/")
+        request.user = self.user
+        table = CirculatedOrderTable(
+            self.mfr.prod_set.filter(prod_no=first.prod_no), totals=totals
+        )
+        RequestConfig(request).configure(table)
+        footers = {
+            column.name: column.footer
+            for column in table.columns
+            if isinstance(column.column, SummingColums)
+        }
+        self.assertIn("value='4'", footers["co_order_box_quantity"])
+        self.assertIn("value='400'", footers["co_order_cost_price"])
+        self.assertIn("value='47'", footers["co_total_quantity"])
+
+    def test_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.post("1234567801", [(self.prods[0], 1)]).status_code, 400)
+        self.assertFalse(Checklist.objects.exists())
+
+
+class ValidationTraceTest(OrderRuleTestMixin, TestCase):
+    def test_debug_reports_rule_traces(self):
+        self.create_rule(or_prod_no=self.prods[0], or_shipped_as_case=True)
+        products = [
+            {"prod_no": prod.prod_no, "prod_quantity": 10} for prod in self.prods
+        ]
+        response = self.client.post(
+            reverse("api:create_order"),
+            {"products": products, "action": "validation", "debug": True},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        debug = response.json()["debug"]
+        traces = {
+            (r["or_type"], r["target"]): r for r in debug["rules"] if r["lookups"]
+        }
+        rule_trace = traces[(OrderRuleTypeChoices.Product, str(self.prods[0]))]
+        self.assertEqual(rule_trace["matched"], 1)
+        self.assertIn((OrderRuleTypeChoices.Manufacturer, str(self.mfr)), traces)
+        self.assertGreater(debug["queries"], 0)
+
+    def test_no_debug_section_by_default(self):
+        response = self.client.post(
+            reverse("api:create_order"),
+            {"products": [], "action": "validation"},
+            content_type="application/json",
+        )
+        self.assertIsNone(response.json().get("debug"))
+
+
+class OrderRuleOverlapTest(OrderRuleTestMixin, TestCase):
+    def test_clean_rejects_overlapping_rule(self):
+        today = timezone.localdate()
+        self.create_rule(
+            or_type=OrderRuleTypeChoices.Manufacturer,
+            or_mfr_id=self.mfr,
+            or_effective_start_date=today,
+            or_effective_end_date=today + timezone.timedelta(days=10),
+        )
+        rule = OrderRule(
+            or_type=OrderRuleTypeChoices.Manufacturer,
+            or_mfr_id=self.mfr,
+            or_effective_start_date=today + timezone.timedelta(days=10),
+            or_effective_end_date=today + timezone.timedelta(days=20),
+        )
+        with self.assertRaises(ValidationError):
+            rule.clean()
+        rule.or_effective_start_date = today + timezone.timedelta(days=11)
+        rule.clean()
+
+    def test_audit_command_reports_overlaps(self):
+        today = timezone.localdate()
+        # (9, 11) overlaps both (0, 10) and (8, 12)
+        for start, end in [(0, 10), (5, 6), (8, 12), (9, 11), (13, 20)]:
+            self.create_rule(
+                or_type=OrderRuleTypeChoices.Product,
+                or_prod_no=self.prods[0],
+                or_effective_start_date=today + timezone.timedelta(days=start),
+                or_effective_end_date=today + timezone.timedelta(days=end),
+            )
+        out = StringIO()
+        call_command("order_rule_audit", stdout=out)
+        self.assertIn("4 overlapping rule pairs found", out.getvalue())
+
+
+class OrderCreateMultipleTest(OrderRuleTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="buyer")
+        self.mfr.mfr_user_id = self.user
+        self.mfr.save()
+        self.session = SessionStore()
+
+    def request(self, method, data):
+        request = getattr(RequestFactory(), method)("/", data)
+        request.user = self.user
+        request.session = self.session
+        return OrderCreateMultipleView.as_view()(request)
+
+    def post_data(self, named_formset):
+        data = {}
+        for formset in [named_formset["order_formset"]] + list(
+            named_formset["prods_formset_list"]
+        ):
+            for name in formset.management_form.fields:
+                data[
+                    formset.management_form.add_prefix(name)
+                ] = formset.management_form[name].value()
+            for form in formset:
+                for field in form:
+                    if not field.field.disabled and field.value() is not None:
+                        data[field.html_name] = field.value()
+        return data
+
+    def get_named_formset(self):
+        response = self.request(
+            "get", {"b_form-clipboard": f"{self.prods[0].prod_no}\t10"}
+        )
+        return response.context_data["named_formset"]
+
+    def test_numbers_are_reserved_when_saved(self):
+        [od_no] = peek_order_nos()
+        named_formset = self.get_named_formset()
+        self.get_named_formset()
+        # showing the form reserves nothing
+        self.assertFalse(OrderNoSequence.objects.exists())
+        self.assertEqual(
+            named_formset["order_formset"].forms[0].initial["od_no"], od_no
+        )
+
+        data = self.post_data(named_formset)
+        data["order-0-od_except_arrival_date"] = "2000-01-01"
+        self.request("post", data)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(peek_order_nos(), range(od_no, od_no + 1))
+
+        data = self.post_data(self.get_named_formset())
+        self.assertEqual(self.request("post", data).status_code, 302)
+        order = Order.objects.get()
+        self.assertEqual(order.od_no, od_no)
+        self.assertEqual(order.orderprod_set.get().op_prod_no, self.prods[0])
+
+
+class ReserveOrderNosTest(TestCase):
+    day = date(2024, 3, 5)
+
+    def test_blocks_are_consecutive_and_disjoint(self):
+        self.assertEqual(list(reserve_order_nos(day=self.day)), [2024330500001])
+        self.assertEqual(
+            list(reserve_order_nos(3, self.day)),
+            [2024330500002, 2024330500003, 2024330500004],
+        )
+        self.assertEqual(list(reserve_order_nos(day=date(2024, 3, 6))), [2024330600001])
+
+    def test_continues_after_existing_orders(self):
+        Order.objects.create(od_no=2024330500007, od_except_arrival_date=self.day)
+        self.assertEqual(
+            list(reserve_order_nos(2, self.day)), [2024330500008, 2024330500009]
+        )
+
+    def test_single_query_once_the_day_exists(self):
+        reserve_order_nos(day=self.day)
+        with self.assertNumQueries(1):
+            reserve_order_nos(10, self.day)
+
+
+class OrderBenchTest(TestCase):
+    def test_bench_writes_report_and_rolls_back(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "bench.json")
+            call_command(
+                "order_bench",
+                products=[50],
+                rules=20,
+                lines=[10, 100],
+                manufacturers=5,
+                repeat=1,
+                output=output,
+                stdout=StringIO(),
+            )
+            with open(output) as f:
+                report = json.load(f)
+        [run] = report["runs"]
+        self.assertEqual((run["products"], run["lines"]), (50, 10))
+        self.assertGreater(run["validate_order"]["cold"]["queries"], 0)
+        self.assertIn("peak_memory", run["validate_order"])
+        self.assertFalse(Prod.objects.exists())
+        self.assertFalse(OrderRule.objects.exists())
+
+    def test_refuses_a_database_with_a_catalog(self):
+        Manufacturer.objects.create(
+            mfr_main_id="12345678",
+            mfr_sub_id="01",
+            mfr_name="test mfr",
+            mfr_address="test address",
+        )
+        with self.assertRaisesMessage(CommandError, "Manufacturer"):
+            call_command("order_bench", products=[10], stdout=StringIO())
+        self.assertTrue(Manufacturer.objects.exists())
+
+
+class OrderSuggestTest(OrderRuleTestMixin, TestCase):
+    def order(self, prod, quantity, days_ago, status=StatusChoices.Generated):
+        day = timezone.now() - timezone.timedelta(days=days_ago)
+        [od_no] = reserve_order_nos(day=timezone.localdate(day))
+        order = Order.objects.create(
+            od_no=od_no, od_date=day, od_except_arrival_date=day
+        )
+        OrderProd.objects.create(
+            op_od_no=order, op_prod_no=prod, op_quantity=quantity, op_status=status
+        )
+
+    def test_suggestions_are_rounded_to_cases(self):
+        first, second, third = self.prods
+        self.order(first, 7, 1)
+        self.order(first, 5, 2)
+        self.order(first, 100, 10)
+        self.order(second, 50, 1, StatusChoices.Cancelled)
+        ReplenishmentSuggestion.objects.create(
+            rs_prod_no=third, rs_suggested_quantity=10, rs_computed_at=timezone.now()
+        )
+        call_command(
+            "order_suggest", window=4, cover_days=4, safety=0, stdout=StringIO()
+        )
+        # 12 ordered in 4 days, 12 covers 4 days and 2 cases of 10 hold it
+        [suggestion] = ReplenishmentSuggestion.objects.all()
+        self.assertEqual(suggestion.rs_prod_no, first)
+        self.assertEqual(suggestion.rs_daily_demand, 3)
+        self.assertEqual(suggestion.rs_suggested_quantity, 20)
+
+        request = RequestFactory().get("/")
+        request.user = get_user_model().objects.create_user(username="buyer")
+        table = CirculatedOrderTable(
+            self.mfr.prod_set.select_related("suggestion").order_by("prod_no")
+        )
+        RequestConfig(request).configure(table)
+        rows = list(table.rows)
+        # the suggestions come with the products, rendering reads nothing
+        with self.assertNumQueries(0):
+            cells = [row.get_cell("co_suggested_quantity") for row in rows]
+        self.assertIn('value="20"', cells[0])
+        self.assertIn('value="0"', cells[1])
+
+
+class CirculatedOrderStreamTest(OrderRuleTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="buyer")
+        self.client.force_login(self.user)
+        self.mfr.mfr_user_id = self.user
+        self.mfr.save()
+        other = Manufacturer.objects.create(
+            mfr_main_id="87654321",
+            mfr_sub_id="01",
+            mfr_name="other mfr",
+            mfr_address="test address",
+            mfr_user_id=self.user,
+        )
+        self.other_prods = [
+            Prod.objects.create(
+                prod_name=f"other prod {i}",
+                prod_cate_no=self.subsubcate,
+                prod_cost_price=10,
+                prod_retail_price=20,
+                prod_sell_zone="1",
+                prod_outer_quantity=1,
+                prod_inner_quantity=1,
+                prod_mfr_id=other,
+            )
+            for i in range(2)
+        ]
+        Checklist.objects.create(
+            cl_user_id=self.user,
+            cl_mfr_full_id=other.mfr_full_id,
+            cl_prod_no=self.other_prods[1],
+            cl_order_quantity=8,
+        )
+
+    def test_feed_pages_every_manufacturer(self):
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    reverse("api:list_circulated_order_products"), params
+                )
+            # one keyset query for the products, one for the checklists
+            self.assertEqual(
+                len([q for q in queries if 'FROM "prod_prod"' in q["sql"]]), 1
+            )
+            page = response.json()
+            pages.append(page)
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+
+        rows = [row for page in pages for row in page["results"]]
+        self.assertEqual(
+            [row["prod_no"] for row in rows],
+            [prod.prod_no for prod in self.prods + self.other_prods],
+        )
+        self.assertEqual(
+            [row["order_quantity"] for row in rows], [None, None, None, None, 8]
+        )
+        self.assertIn('data-mfr-full-id="8765432101"', pages[-1]["html"])
+        self.assertIn("checked", pages[-1]["html"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            reverse("api:list_circulated_order_products"), {"cursor": "x"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["code"], "invalid_cursor")
+
+    def test_feed_of_another_buyer_needs_staff(self):
+        other_user = get_user_model().objects.create_user(username="other")
+        self.client.force_login(other_user)
+        url = reverse("api:list_circulated_order_products")
+        response = self.client.get(url, {"mfr_user_id": self.user.pk})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(url).json()["results"], [])
+
+        other_user.is_staff = True
+        other_user.save()
+        response = self.client.get(url, {"mfr_user_id": self.user.pk, "limit": 10})
+        self.assertEqual(len(response.json()["results"]), 5)
+
+    def test_view_of_another_buyer_needs_staff(self):
+        other_user = get_user_model().objects.create_user(username="other")
+        request = RequestFactory().get(
+            "/", {"stream": "1", "mfr_user_id": self.user.pk}
+        )
+        request.user = other_user
+        with self.assertRaises(PermissionDenied):
+            OrderCirculatedOrderView.as_view()(request)
+
+        other_user.is_staff = True
+        context = OrderCirculatedOrderView.as_view()(request).context_data
+        self.assertEqual(len(list(context["table"].rows)), 5)
+
+    def test_manufacturer_name_is_escaped(self):
+        self.mfr.mfr_name = "<script>x</script>"
+        self.mfr.save()
+        html = self.client.get(reverse("api:list_circulated_order_products")).json()[
+            "html"
+        ]
+        self.assertNotIn("<script>", html)
+        self.assertIn("&lt;script&gt;", html)
+
+    @override_config(CIRCULATED_ORDER_PER_PAGE_ITEMS=4)
+    def test_view_lists_every_manufacturer(self):
+        request = RequestFactory().get("/", {"stream": "1"})
+        request.user = self.user
+        # the template response is not rendered, the page needs built assets
+        context = OrderCirculatedOrderView.as_view()(request).context_data
+        table = context["table"]
+        with CaptureQueriesContext(connection) as queries:
+            rows = [(row.record, row.get_cell("co_func")) for row in table.rows]
+        self.assertFalse(queries)
+        self.assertEqual(
+            [record.prod_no for record, func in rows],
+            [prod.prod_no for prod in self.prods + self.other_prods[:1]],
+        )
+        self.assertEqual(
+            context["next_cursor"],
+            f"{self.other_prods[0].prod_mfr_id_id}-{self.other_prods[0].prod_no}",
+        )
+        self.assertIn("co_mfr", table.columns.names())
+        self.assertFalse(table.show_footer)
+
+
+class OrderSearchTest(OrderRuleTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="buyer")
+        self.mfr.mfr_user_id = self.user
+        self.mfr.save()
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse("api:create_order"),
+            {
+                "action": "create",
+                "products": [
+                    {"prod_no": prod.prod_no, "prod_quantity": 10}
+                    for prod in self.prods[:2]
+                ],
+            },
+            content_type="application/json",
+        )
+        self.order = Order.objects.get()
+
+    def filter(self, **data):
+        return list(OrderFilter(data, queryset=Order.objects.all()).qs)
+
+    def test_kept_in_sync_on_write(self):
+        first, second, third = self.prods
+        search = OrderSearch.objects.get()
+        self.assertEqual(search.os_user_id, self.user)
+
+        # the lines are not copied, writing them leaves the search row alone
+        with CaptureQueriesContext(connection) as queries:
+            OrderProd.objects.create(op_od_no=self.order, op_prod_no=third)
+            OrderProd.objects.get(op_prod_no=first).delete()
+        self.assertFalse([q for q in queries if "order_ordersearch" in q["sql"]])
+        self.assertEqual(self.filter(od_prod=first.prod_no), [])
+        self.assertEqual(self.filter(od_prod=third.prod_no), [self.order])
+
+        self.order.od_notes = "urgent"
+        self.order.save()
+        other = get_user_model().objects.create_user(username="other")
+        self.mfr.mfr_user_id = other
+        self.mfr.save()
+        search.refresh_from_db()
+        self.assertEqual(search.os_notes, "urgent")
+        self.assertEqual(search.os_user_id, other)
+
+        self.order.delete()
+        self.assertFalse(OrderSearch.objects.exists())
+
+    def test_filters_read_the_search_rows(self):
+        first, second, third = self.prods
+        self.assertEqual(self.filter(od_mfr_id__mfr_user_id=self.user.pk), [self.order])
+        self.assertEqual(self.filter(od_prod=first.prod_no), [self.order])
+        self.assertEqual(self.filter(od_prod=third.prod_no), [])
+        self.assertEqual(self.filter(od_notes="urgent"), [])
+        today = timezone.localdate().isoformat()
+        self.assertEqual(self.filter(od_date_after=today), [self.order])
+
+        sql = str(
+            OrderFilter(
+                {"od_mfr_id__mfr_user_id": self.user.pk, "od_date_after": today},
+                queryset=Order.objects.all(),
+            ).qs.query
+        )
+        # one join to the search rows, none to the manufacturers
+        self.assertEqual(sql.count('JOIN "order_ordersearch"'), 1)
+        self.assertNotIn("manufacturer", sql)
+
+    def test_rebuild(self):
+        OrderSearch.objects.all().delete()
+        call_command("order_search_rebuild", batch_size=1, stdout=StringIO())
+        self.assertEqual(OrderSearch.objects.get().os_od_no, self.order)
+
+    def test_order_no_prefix(self):
+        request = RequestFactory().get("/", {"q": str(self.order.od_no)[:8]})
+        request.user = self.user
+        view = OrderNoAutocomplete()
+        view.setup(request)
+        view.q = request.GET["q"]
+        self.assertEqual(list(view.get_queryset()), [self.order])
+        view.q = "9"
+        self.assertEqual(list(view.get_queryset()), [])
@@ -1,5 +1,6 @@
 import logging
 import re
+from functools import cached_property
 from typing import List
 
 from constance import config
@@ -7,6 +8,8 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Div, Field, Layout, Submit
 from dal import autocomplete
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
 from django.forms import modelformset_factory
 from django.forms.models import BaseModelFormSet
 from django.http import QueryDict
@@ -22,7 +25,13 @@ from django_tables2 import SingleTableMixin
 from accounts.models import CustomUser
 from manufacturer.models import Manufacturer
 from prod.models import Prod
-from utils.order import get_order_no_from_day
+from utils.order import (
+    get_checklist_totals,
+    get_circulated_order_page,
+    get_order_no_prefix_range,
+    peek_order_nos,
+    reserve_order_nos,
+)
 
 from .filters import OrderCirculatedOrderFilter, OrderFilter, OrderRulesFilter
 from .forms import (
@@ -72,7 +81,11 @@ class OrderListView(SingleTableMixin, FilterView):
                 ),
                 css_class="col-xl-3",
             ),
-            Div(Field("od_mfr_id__mfr_user_id"), css_class="col-xl-3"),
+            Div(
+                Field("od_mfr_id__mfr_user_id"),
+                Field("od_notes"),
+                css_class="col-xl-3",
+            ),
         )
         form.helper.form_class = "row"
         form.helper.form_id = "order-filter-form"
@@ -146,13 +159,15 @@ class OrderCreateMultipleView(CreateView):
         order_initial = []
         prods_formset_list = []
         prods_formset_initial_dict = {}
+        # shown only, the numbers are reserved when the orders are saved
+        od_nos = peek_order_nos(len(clipboard))
 
         for i, (mfr_id, prods) in enumerate(clipboard.items()):
             mfr_id = int(mfr_id.replace("_", ""))
             OrderProdDynamicFormset = modelformset_factory(
                 OrderProd, OrderProdCreateForm, extra=len(prods), can_delete=True
             )
-            od_no = get_order_no_from_day() + i + 1
+            od_no = od_nos[i]
             mfr = Manufacturer.objects.get(mfr_id=mfr_id)
             order_initial.append(
                 {
@@ -216,15 +231,15 @@ class OrderCreateMultipleView(CreateView):
         order_formset: BaseModelFormSet,
         orderprod_formset_list: List[BaseModelFormSet],
     ):
-        # TODO: it shouldn't create order if orderprod formset is not valid
+        # called inside the transaction of post, the orders are rolled back
+        # with their numbers when a line is not valid
         orders = order_formset.save(commit=False)
         for order in orders:
             order.save()
 
         # orderprod formset is not valid
         if not all([_.is_valid() for _ in orderprod_formset_list]):
-            for order in orders:
-                order.delete()
+            transaction.set_rollback(True)
 
             return self.render_to_response(
                 self.get_context_data(
@@ -282,29 +297,48 @@ class OrderCreateMultipleView(CreateView):
     def post(self, request, *args, **kwargs):
         self.object = None
 
-        order_formset = OrderFormset(
-            data=request.POST,
-            prefix="order",
-            initial=request.session.get("order_formset_initial", None),
-        )
-
         prods_formset_initial_dict: dict = request.session.get(
             "prods_formset_initial", None
         )
 
-        orderprod_formset_list = [
-            OrderProdCreateFormset(
-                data=request.POST,
-                prefix=prefix,
-                initial=prods_formset_initial_dict.get(prefix, None),
+        with transaction.atomic():
+            # the numbers shown were not reserved, reserve them now; any
+            # failure rolls the reservation back with the orders
+            data = self.with_reserved_order_nos(
+                request.POST, len(prods_formset_initial_dict)
             )
-            for prefix in prods_formset_initial_dict.keys()
-        ]
 
-        if order_formset.is_valid():
-            return self.form_valid(order_formset, orderprod_formset_list)
-        else:
-            return self.form_invalid(order_formset, orderprod_formset_list)
+            order_formset = OrderFormset(
+                data=data,
+                prefix="order",
+                initial=request.session.get("order_formset_initial", None),
+            )
+
+            orderprod_formset_list = [
+                OrderProdCreateFormset(
+                    data=data,
+                    prefix=prefix,
+                    initial=prods_formset_initial_dict.get(prefix, None),
+                )
+                for prefix in prods_formset_initial_dict.keys()
+            ]
+
+            if order_formset.is_valid():
+                return self.form_valid(order_formset, orderprod_formset_list)
+            else:
+                transaction.set_rollback(True)
+                return self.form_invalid(order_formset, orderprod_formset_list)
+
+    def with_reserved_order_nos(self, data: QueryDict, count: int) -> QueryDict:
+        """Replace the shown order numbers of the posted data with reserved ones."""
+        data = data.copy()
+        for i, od_no in enumerate(reserve_order_nos(count)):
+            data[f"order-{i}-od_no"] = od_no
+            prefix = f"orderprod_{i}-"
+            for key in data:
+                if key.startswith(prefix) and key.endswith("-op_od_no"):
+                    data[key] = od_no
+        return data
 
 
 class OrderRulesView(SingleTableMixin, FilterView):
@@ -319,7 +353,7 @@ class OrderNoAutocomplete(autocomplete.Select2QuerySetView):
     def get_queryset(self):
         qs = Order.objects.all()
         if self.q:
-            qs = qs.filter(od_no__startswith=self.q)
+            qs = qs.filter(od_no__range=get_order_no_prefix_range(self.q))
         return qs.order_by("-od_no")
 
 
@@ -346,26 +380,74 @@ class OrderCirculatedOrderView(
         return kwargs
 
     def get_table_pagination(self, table):
+        if self.streaming:
+            # the following pages come from the keyset feed
+            return False
         paginate = super().get_table_pagination(table)
         paginate["per_page"] = config.CIRCULATED_ORDER_PER_PAGE_ITEMS
         return paginate
 
-    def get_table_data(self):
+    @cached_property
+    def streaming(self):
+        # every product of every manufacturer in one scrolling table
+        return self.request.GET.get("stream") == "1"
+
+    @cached_property
+    def buyer(self):
+        mfr_user_id = self.request.GET.get("mfr_user_id")
+        if mfr_user_id is None or mfr_user_id == str(self.request.user.pk):
+            return self.request.user
+        # like the feed, only staff may list the manufacturers of another buyer
+        if not self.request.user.is_staff:
+            raise PermissionDenied
+        return CustomUser.objects.get(pk=mfr_user_id)
+
+    @cached_property
+    def current_mfr(self):
         mfr_page = int(self.request.GET.get(self.page_kwarg, 1))
         try:
             current_mfr = self.object_list.__getitem__(mfr_page - 1)
             if isinstance(current_mfr, Manufacturer):
-                return current_mfr.prod_set.all()
+                return current_mfr
         except:
             pass
 
+        return None
+
+    def get_table_data(self):
+        if self.streaming:
+            products, self.next_cursor = get_circulated_order_page(
+                self.buyer, limit=config.CIRCULATED_ORDER_PER_PAGE_ITEMS
+            )
+            return products
+        if self.current_mfr is not None:
+            return self.current_mfr.prod_set.select_related("suggestion")
+
         return Prod.objects.none()
 
+    def get_table_kwargs(self):
+        kwargs = super().get_table_kwargs()
+        if self.streaming:
+            kwargs.update(orderable=False, show_footer=False)
+            return kwargs
+        kwargs["exclude"] = ("co_mfr",)
+        if self.current_mfr is not None:
+            # footers total every page of the manufacturer, not the shown rows
+            kwargs["totals"] = get_checklist_totals(
+                self.request.user, self.current_mfr.mfr_full_id
+            )
+        return kwargs
+
+    def get_table(self, **kwargs):
+        table = super().get_table(**kwargs)
+        if self.streaming:
+            table.load_checklists(
+                {record.prod_mfr_id.mfr_full_id for record in table.data}
+            )
+        return table
+
     def get_queryset(self):
-        u = self.request.user
-        if "mfr_user_id" in self.request.GET:
-            u = CustomUser.objects.get(pk=self.request.GET["mfr_user_id"])
-        return Manufacturer.objects.filter(mfr_user_id=u).order_by("mfr_id")
+        return Manufacturer.objects.filter(mfr_user_id=self.buyer).order_by("mfr_id")
 
     def get_filterset_kwargs(self, filterset_class):
         kwargs = super().get_filterset_kwargs(filterset_class)
@@ -381,4 +463,7 @@ class OrderCirculatedOrderView(
         context = super().get_context_data(**kwargs)
         context["header_title"] = _("每日訂貨作業")
         context["header_description"] = _("查看每日訂貨資料，並進行維護。")
+        context["stream"] = self.streaming
+        if self.streaming:
+            context["next_cursor"] = self.next_cursor
         return context
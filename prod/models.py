@@ -229,6 +229,9 @@ class Prod(models.Model):
         on_delete=models.CASCADE,
         default=1,
     )
+    prod_updated_at = models.DateTimeField(
+        verbose_name=_("商品上次更新時間"), auto_now=True
+    )
 
     def __str__(self) -> str:
         return str(self.prod_no) + " - " + self.prod_name
@@ -110,6 +110,16 @@ $(function () {
             success: (_) => {
                 output.text(_["message"]);
             },
+            error: (xhr) => {
+                let errors = (xhr.responseJSON || {})["errors"] || [];
+                let list = $("<ul>");
+                for (let error of errors) {
+                    list.append(
+                        $("<li>").text(`row ${error["obj"] + 1}: ${error["message"]}`)
+                    );
+                }
+                output.empty().append(list);
+            },
         });
     }
 });
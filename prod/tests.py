@@ -1,3 +1,334 @@
+import csv
+import json
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from manufacturer.models import Manufacturer
+from prod.models import CateTypeChoices, Prod, ProdCategory
+
+
+class ProductTestMixin:
+    @classmethod
+    def setUpTestData(cls):
+        cls.mfr = Manufacturer.objects.create(
+            mfr_main_id="12345678",
+            mfr_sub_id="01",
+            mfr_name="test mfr",
+            mfr_address="test address",
+        )
+        cls.cate = ProdCategory.objects.create(
+            cate_no="010101", cate_name="LLA", cate_type=CateTypeChoices.SubSubCate
+        )
+
+    @classmethod
+    def product(cls, prod_no, **kwargs):
+        return Prod(
+            **{
+                "prod_no": prod_no,
+                "prod_name": f"prod {prod_no}",
+                "prod_cate_no": cls.cate,
+                "prod_cost_price": 10,
+                "prod_retail_price": 20,
+                "prod_sell_zone": "1",
+                "prod_outer_quantity": 2,
+                "prod_inner_quantity": 5,
+                "prod_mfr_id": cls.mfr,
+                **kwargs,
+            }
+        )
+
+
+class CreateProductsTest(ProductTestMixin, TestCase):
+    def row(self, prod_no, **kwargs):
+        return {
+            "prod_no": prod_no,
+            "prod_name": f"prod {prod_no}",
+            "prod_cate_no": self.cate.cate_no,
+            "prod_mfr_id": self.mfr.mfr_id,
+            **kwargs,
+        }
+
+    def post(self, rows):
+        return self.client.post(
+            reverse("api:create_product"), rows, content_type="application/json"
+        )
+
+    def test_create_list_in_bulk(self):
+        rows = [self.row(prod_no) for prod_no in range(1, 201)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(rows)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Prod.objects.count(), 200)
+        # two lookups, the duplicate check and a few chunked inserts
+        self.assertLess(len(queries), 15)
+
+    def test_errors_are_reported_per_row(self):
+        self.post([self.row(1)])
+        response = self.post(
+            [
+                self.row(1),
+                self.row(2, prod_cate_no="999999"),
+                self.row(3, prod_mfr_id=999),
+                self.row(4),
+                self.row(4),
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [(error["obj"], error["code"]) for error in response.json()["errors"]],
+            [
+                (0, "product_already_exist"),
+                (1, "category_not_exist"),
+                (2, "manufacturer_not_exist"),
+                (4, "product_already_exist"),
+            ],
+        )
+        self.assertEqual(Prod.objects.count(), 1)
+
+
+class UpdateProductsTest(ProductTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Prod.objects.bulk_create(
+            cls.product(prod_no, prod_quantity=10) for prod_no in range(1, 4)
+        )
+
+    def put(self, rows, mode="set"):
+        return self.client.put(
+            reverse("api:update_products") + f"?mode={mode}",
+            rows,
+            content_type="application/json",
+        )
+
+    def quantities(self):
+        return list(
+            Prod.objects.order_by("prod_no").values_list("prod_quantity", flat=True)
+        )
+
+    def test_set_quantities(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.put(
+                [{"prod_no": 1, "prod_quantity": 3}, {"prod_no": 3, "prod_quantity": 0}]
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), [3, 10, 0])
+        [update] = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertIn("CASE", update)
+        self.assertNotIn("prod_name", update)
+
+    def test_delta_quantities(self):
+        response = self.put(
+            [
+                {"prod_no": 1, "prod_quantity": -4},
+                {"prod_no": 2, "prod_quantity": 5},
+                {"prod_no": 1, "prod_quantity": -1},
+            ],
+            mode="delta",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), [5, 15, 10])
+
+    def test_missing_product_or_negative_stock_updates_nothing(self):
+        response = self.put(
+            [{"prod_no": 1, "prod_quantity": 3}, {"prod_no": 99, "prod_quantity": 1}]
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.put(
+            [{"prod_no": 1, "prod_quantity": 3}, {"prod_no": 2, "prod_quantity": -11}],
+            mode="delta",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.quantities(), [10, 10, 10])
+
+
+class ListProductsTest(ProductTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.mfrs = [
+            Manufacturer.objects.create(
+                mfr_main_id="12345678",
+                mfr_sub_id="00",
+                mfr_name="test mfr 0",
+                mfr_address="test address",
+            ),
+            cls.mfr,
+        ]
+        ProdCategory.objects.create(
+            cate_no="000001", cate_name="LLA", cate_type=CateTypeChoices.Cate
+        )
+        cates = [
+            cls.cate,
+            ProdCategory.objects.create(
+                cate_no="020101", cate_name="LLA", cate_type=CateTypeChoices.SubSubCate
+            ),
+        ]
+        Prod.objects.bulk_create(
+            cls.product(
+                prod_no,
+                prod_cate_no=cates[prod_no % 2],
+                prod_mfr_id=cls.mfrs[prod_no % 2],
+            )
+            for prod_no in range(1, 8)
+        )
+
+    def get(self, **params):
+        return self.client.get(reverse("api:list_products"), params).json()
+
+    def test_pages_follow_the_cursor(self):
+        prod_nos, cursor = [], None
+        while True:
+            params = {"limit": 3, "fields": "prod_name"}
+            if cursor is not None:
+                params["cursor"] = cursor
+            page = self.get(**params)
+            prod_nos += [product["prod_no"] for product in page["results"]]
+            self.assertEqual(
+                {key for product in page["results"] for key in product},
+                {"prod_no", "prod_name"},
+            )
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(prod_nos, list(range(1, 8)))
+
+    def test_filters(self):
+        page = self.get(mfr_id=self.mfrs[0].mfr_id, fields="prod_mfr_id")
+        self.assertEqual([p["prod_no"] for p in page["results"]], [2, 4, 6])
+        page = self.get(cate_no="000001", sales_status=1)
+        self.assertEqual([p["prod_no"] for p in page["results"]], [2, 4, 6])
+        page = self.get(cate_no="020101")
+        self.assertEqual([p["prod_no"] for p in page["results"]], [1, 3, 5, 7])
+
+    def test_invalid_field(self):
+        response = self.client.get(reverse("api:list_products"), {"fields": "secret"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_csv(self):
+        response = self.client.get(reverse("api:export_products"), {"related": True})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(
+            csv.reader(b"".join(response.streaming_content).decode().splitlines())
+        )
+        self.assertIn("prod_mfr_id__mfr_full_id", rows[0])
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows[1][rows[0].index("prod_name")], "prod 1")
+
+    def test_export_ndjson(self):
+        response = self.client.get(reverse("api:export_products"), {"format": "ndjson"})
+        products = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual([p["prod_no"] for p in products], list(range(1, 8)))
+        self.assertEqual(products[0]["prod_cate_no"], "020101")
+
+
+class GetProductTest(ProductTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.prod = cls.product(1)
+        cls.prod.save()
+
+    def get(self, **headers):
+        return self.client.get(
+            reverse("api:get_product", kwargs={"prod_no": 1}), headers=headers
+        )
+
+    def test_etag_revalidation(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('W/"1-'))
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(1):
+            response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertIn("Last-Modified", response)
+
+        self.client.put(
+            reverse("api:update_products"),
+            [{"prod_no": 1, "prod_quantity": 3}],
+            content_type="application/json",
+        )
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["prod_quantity"], 3)
+
+
+class AsyncProductApiTest(ProductTestMixin, TestCase):
+    async def test_create_update_and_read(self):
+        response = await self.async_client.post(
+            reverse("api:async_create_product"),
+            [
+                {
+                    "prod_no": prod_no,
+                    "prod_name": f"prod {prod_no}",
+                    "prod_cate_no": self.cate.cate_no,
+                    "prod_mfr_id": self.mfr.mfr_id,
+                }
+                for prod_no in (1, 2)
+            ],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.put(
+            reverse("api:async_update_products") + "?mode=delta",
+            [{"prod_no": 2, "prod_quantity": 4}],
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.get(
+            reverse("api:async_get_product", kwargs={"prod_no": 2})
+        )
+        self.assertEqual(response.json()["prod_quantity"], 4)
+        etag = response["ETag"]
+        response = await self.async_client.get(
+            reverse("api:async_get_product", kwargs={"prod_no": 2}),
+            headers={"if_none_match": etag},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertIn("Last-Modified", response)
+
+        response = await self.async_client.get(
+            reverse("api:async_list_products"), {"limit": 1, "fields": "prod_name"}
+        )
+        self.assertEqual(
+            response.json(),
+            {"results": [{"prod_no": 1, "prod_name": "prod 1"}], "next_cursor": 1},
+        )
+
+    async def test_single_product_matches_the_sync_contract(self):
+        data = {
+            "prod_no": 3,
+            "prod_name": "prod 3",
+            "prod_cate_no": "missing",
+            "prod_mfr_id": self.mfr.mfr_id,
+        }
+        for name in ("api:create_product", "api:async_create_product"):
+            response = await self.async_client.post(
+                reverse(name), data, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json()["code"], "category_not_exist")
 
-# Create your tests here.
+        data["prod_cate_no"] = self.cate.cate_no
+        response = await self.async_client.post(
+            reverse("api:async_create_product"), data, content_type="application/json"
+        )
+        self.assertEqual(response.json()["message"], "Product created successfully")
+        response = await self.async_client.post(
+            reverse("api:async_create_product"), data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 500)
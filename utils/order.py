@@ -1,18 +1,49 @@
 import logging
-from dataclasses import dataclass
-from typing import List, Literal, Tuple, Union
-
+from bisect import bisect_right
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from datetime import date
+from itertools import accumulate
+from types import MappingProxyType
+from typing import Dict, Iterator, List, Literal, Mapping, Optional, Tuple, Union
+
+import numpy as np
+from constance import config
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, FilteredRelation, FloatField, Max, Q, QuerySet, Sum
+from django.db.models.functions import Coalesce, NullIf
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from rich.pretty import pretty_repr
 
 from manufacturer.models import Manufacturer
-from order.models import Order, OrderRule, OrderRuleTypeChoices
+from order.models import (
+    Checklist,
+    Order,
+    OrderNoSequence,
+    OrderProd,
+    OrderRule,
+    OrderRuleTypeChoices,
+    OrderRuleVersion,
+    OrderSearch,
+)
 from prod.models import Prod, ProdCategory, UnitChoices
+from utils.tracing import current_trace, trace_target
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# orders with at least this many lines are checked by the vectorized path
+VECTORIZE_THRESHOLD = 200
+# number of lines checked at a time by iter_validate_order
+VALIDATION_CHUNK_SIZE = 500
+# primary key of the single OrderRuleVersion row
+RULE_VERSION_ID = 1
+# digits of an order number, YYYY(mm+30)dd and a five digit sequence
+ORDER_NO_DIGITS = 13
+# rows upserted per statement by refresh_order_search
+ORDER_SEARCH_BATCH_SIZE = 1000
+
 
 @dataclass
 class OrderProdSchema:
@@ -20,43 +51,325 @@ class OrderProdSchema:
     prod_quantity: int
 
 
-def validate_order(data: List[OrderProdSchema]):
+def get_rule_version() -> int:
+    version = OrderRuleVersion.objects.values_list("orv_version", flat=True).first()
+    return version or 0
+
+
+def bump_rule_version():
+    updated = OrderRuleVersion.objects.filter(pk=RULE_VERSION_ID).update(
+        orv_version=F("orv_version") + 1
+    )
+    if not updated:
+        OrderRuleVersion.objects.get_or_create(
+            pk=RULE_VERSION_ID, defaults={"orv_version": 1}
+        )
+
+
+class RuleIntervals:
+    """
+    The rules of one target sorted by effective start date.
+
+    ``max_ends[i]`` is the latest effective end date among ``rules[: i + 1]``,
+    so a lookup bisects to the last rule starting on or before the date and
+    walks back only while an earlier rule can still cover it.
+    """
+
+    __slots__ = ("rules", "starts", "max_ends")
+
+    def __init__(self, rules: List[OrderRule]):
+        self.rules = tuple(sorted(rules, key=lambda r: r.or_effective_start_date))
+        self.starts = tuple(r.or_effective_start_date for r in self.rules)
+        self.max_ends = tuple(
+            accumulate((r.or_effective_end_date for r in self.rules), max)
+        )
+
+    def at(self, day: date) -> Tuple[OrderRule, ...]:
+        found = []
+        i = bisect_right(self.starts, day)
+        while i > 0 and self.max_ends[i - 1] >= day:
+            i -= 1
+            if self.rules[i].or_effective_end_date >= day:
+                found.append(self.rules[i])
+        return tuple(reversed(found))
+
+
+@dataclass(frozen=True)
+class RuleSnapshot:
+    """
+    Compiled, read-only view of the order rules and product categories.
+
+    ``rules`` maps ``(or_type, target_pk)`` to the ``RuleIntervals`` of every
+    rule of that target, and ``category_ancestors`` maps each ``cate_no`` to
+    its own ``ProdCategory`` followed by its 中分類 and 大分類, read from the
+    generated ``cate_subcate_no`` / ``cate_cate_no`` columns.
+
+    Rules are looked up as of ``as_of_date``, or the local date when it is not
+    set (see ``as_of``).
+    """
+
+    version: int
+    rules: Mapping[Tuple[int, object], RuleIntervals]
+    category_ancestors: Mapping[str, Tuple[ProdCategory, ...]]
+    as_of_date: Optional[date] = None
+
+    def as_of(self, day: Optional[date]) -> "RuleSnapshot":
+        return replace(self, as_of_date=day)
+
+    def get_rules(self, or_type: OrderRuleTypeChoices, pk) -> Tuple[OrderRule, ...]:
+        intervals = self.rules.get((or_type, pk))
+        if intervals is None:
+            return ()
+        return intervals.at(self.as_of_date or timezone.localdate())
+
+    def get_category_ancestors(self, cate_no) -> Tuple[ProdCategory, ...]:
+        return self.category_ancestors.get(cate_no, ())
+
+
+def build_rule_snapshot(version: int) -> RuleSnapshot:
+    rules = dict()
+    for rule in OrderRule.objects.all():
+        rules.setdefault((rule.or_type, rule.get_target_pk()), []).append(rule)
+
+    cates = ProdCategory.objects.in_bulk()
+    category_ancestors = dict()
+    for cate_no, cate in cates.items():
+        cate_nos = dict.fromkeys([cate_no, cate.cate_subcate_no, cate.cate_cate_no])
+        category_ancestors[cate_no] = tuple(cates[no] for no in cate_nos if no in cates)
+
+    logger.debug(
+        f"built rule snapshot v{version}: {len(rules)} rule targets, "
+        f"{len(category_ancestors)} categories"
+    )
+    return RuleSnapshot(
+        version=version,
+        rules=MappingProxyType({k: RuleIntervals(v) for k, v in rules.items()}),
+        category_ancestors=MappingProxyType(category_ancestors),
+    )
+
+
+# None outside of a request, False / True inside one (see OrderRuleVersionMiddleware)
+rule_version_checked = ContextVar("rule_version_checked", default=None)
+
+
+class RuleSnapshotStore:
+    """
+    Keep the ``RuleSnapshot`` of this process.
+
+    The snapshot is rebuilt when the shared ``OrderRuleVersion`` counter moves,
+    which happens whenever an ``OrderRule`` or ``ProdCategory`` is saved or
+    deleted in any worker (see ``order.signals``). Inside a request the counter
+    is read at most once.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def get(self) -> RuleSnapshot:
+        snapshot = self._snapshot
+        checked = rule_version_checked.get()
+        if snapshot is not None and checked:
+            return snapshot
+
+        version = get_rule_version()
+        if checked is False:
+            rule_version_checked.set(True)
+        if snapshot is None or snapshot.version != version:
+            snapshot = build_rule_snapshot(version)
+            self._snapshot = snapshot
+        return snapshot
+
+
+rule_snapshots = RuleSnapshotStore()
+
+
+def get_rule_snapshot() -> RuleSnapshot:
+    return rule_snapshots.get()
+
+
+def get_rule(
+    or_item: Union[Prod, ProdCategory, Manufacturer],
+    or_type: OrderRuleTypeChoices,
+    snapshot: Optional[RuleSnapshot] = None,
+) -> Tuple[OrderRule, ...]:
+    trace = current_trace.get()
+    if trace is None:
+        if snapshot is None:
+            snapshot = get_rule_snapshot()
+        return snapshot.get_rules(or_type, or_item.pk)
+
+    with trace.lookup(or_type, or_item) as rule_trace:
+        if snapshot is None:
+            snapshot = get_rule_snapshot()
+        rules = snapshot.get_rules(or_type, or_item.pk)
+        rule_trace.matched = len(rules)
+    return rules
+
+
+def resolve_products(data: List[OrderProdSchema]) -> dict:
+    prod_nos = [order_product.prod_no for order_product in data]
+    return Prod.objects.select_related("prod_mfr_id", "prod_cate_no").in_bulk(prod_nos)
+
+
+async def aresolve_products(data: List[OrderProdSchema]) -> dict:
+    prod_nos = [order_product.prod_no for order_product in data]
+    return await Prod.objects.select_related("prod_mfr_id", "prod_cate_no").ain_bulk(
+        prod_nos
+    )
+
+
+def product_not_exist_error(prod_no) -> dict:
+    return {
+        "code": "product_not_exist",
+        "message": f"Product {prod_no} not found",
+        "obj": prod_no,
+    }
+
+
+def validate_order(
+    data: List[OrderProdSchema],
+    vectorized: Optional[bool] = None,
+    snapshot: Optional[RuleSnapshot] = None,
+    as_of: Optional[date] = None,
+    prods: Optional[dict] = None,
+):
+    """
+    Check an order against the rules, ``prods`` are the products of the lines
+    by number when they have been read already (see ``aresolve_products``).
+    """
+    if snapshot is None:
+        snapshot = get_rule_snapshot()
+    if as_of is not None:
+        snapshot = snapshot.as_of(as_of)
     error_list = []
     prod_dict = dict()
+    if prods is None:
+        prods = resolve_products(data)
     for order_product in data:
-        try:
-            prod = Prod.objects.get(prod_no=order_product.prod_no)
-            prod_dict.update({prod: order_product.prod_quantity})
-        except Prod.DoesNotExist:
-            error_list.append(
-                {
-                    "code": "product_not_exist",
-                    "message": f"Product {order_product.prod_no} not found",
-                    "obj": order_product.prod_no,
-                }
-            )
+        prod = prods.get(order_product.prod_no)
+        if prod is None:
+            error_list.append(product_not_exist_error(order_product.prod_no))
             continue
+        prod_dict.update({prod: order_product.prod_quantity})
     # check product rule
-    for order_product in data:
-        error_list += check_product_rule(order_product)
+    order_products = [
+        (order_product, prods[order_product.prod_no])
+        for order_product in data
+        if order_product.prod_no in prods
+    ]
+    error_list += check_product_rules(order_products, vectorized, snapshot)
 
     # check product category rule
-    error_list += check_category_rule(prod_dict)
+    error_list += check_category_rule(prod_dict, snapshot)
 
     # check manufacturer rule
-    error_list += check_manufacturer_rule(prod_dict)
+    error_list += check_manufacturer_rule(prod_dict, snapshot)
 
     mfr_prod_dict = group_by(prod_dict, "manufacturer")
     return error_list, mfr_prod_dict
 
 
-def check_product_rule(order_product: OrderProdSchema) -> List[dict]:
+def iter_validate_order(
+    data: List[OrderProdSchema],
+    chunk_size: int = VALIDATION_CHUNK_SIZE,
+    snapshot: Optional[RuleSnapshot] = None,
+    as_of: Optional[date] = None,
+) -> Iterator[dict]:
+    """
+    Validate an order like ``validate_order`` and yield the result of every line
+    and then of every category / manufacturer group as soon as it is known.
+
+    Lines are checked ``chunk_size`` at a time, so a large order starts
+    producing results before the last line has been checked.
+    """
+    if snapshot is None:
+        snapshot = get_rule_snapshot()
+    if as_of is not None:
+        snapshot = snapshot.as_of(as_of)
+    prod_dict = dict()
+    prods = resolve_products(data)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start : start + chunk_size]
+        order_products = []
+        # errors by line index, a product can be ordered on several lines
+        line_errors = dict()
+        line_indexes = []
+        for index, order_product in enumerate(chunk):
+            prod = prods.get(order_product.prod_no)
+            if prod is None:
+                line_errors[index] = [product_not_exist_error(order_product.prod_no)]
+                continue
+            prod_dict.update({prod: order_product.prod_quantity})
+            order_products.append((order_product, prod))
+            line_indexes.append(index)
+        for checked, error_list in check_product_lines(
+            order_products, snapshot=snapshot
+        ).items():
+            line_errors[line_indexes[checked]] = error_list
+        for index, order_product in enumerate(chunk):
+            yield {
+                "type": "line",
+                "obj": order_product.prod_no,
+                "errors": line_errors.get(index, []),
+            }
+
+    for group_obj, error_list in iter_group_rule_errors(prod_dict, snapshot):
+        yield {
+            "type": "group",
+            "obj": str(group_obj),
+            "obj_type": group_obj.__class__.__name__,
+            "errors": error_list,
+        }
+
+
+def check_product_rules(
+    order_products: List[Tuple[OrderProdSchema, Prod]],
+    vectorized: Optional[bool] = None,
+    snapshot: Optional[RuleSnapshot] = None,
+) -> List[dict]:
+    return [
+        error
+        for line_errors in check_product_lines(
+            order_products, vectorized, snapshot
+        ).values()
+        for error in line_errors
+    ]
+
+
+def check_product_lines(
+    order_products: List[Tuple[OrderProdSchema, Prod]],
+    vectorized: Optional[bool] = None,
+    snapshot: Optional[RuleSnapshot] = None,
+) -> Dict[int, List[dict]]:
+    """The errors of the failing lines by their index in ``order_products``."""
+    if vectorized is None:
+        vectorized = len(order_products) >= VECTORIZE_THRESHOLD
+    if vectorized:
+        return check_product_rules_vectorized(order_products, snapshot)
+    line_errors = dict()
+    for index, (order_product, prod) in enumerate(order_products):
+        with trace_target(OrderRuleTypeChoices.Product, prod):
+            error_list = check_product_rule(order_product, prod, snapshot)
+        if error_list:
+            line_errors[index] = error_list
+    return line_errors
+
+
+def check_product_rule(
+    order_product: OrderProdSchema,
+    prod: Optional[Prod] = None,
+    snapshot: Optional[RuleSnapshot] = None,
+) -> List[dict]:
     error_list = []
 
-    if isinstance(order_product.prod_no, int):
-        prod = Prod.objects.get(prod_no=order_product.prod_no)
-    else:
-        prod = order_product.prod_no
+    if prod is None:
+        if isinstance(order_product.prod_no, int):
+            prod = Prod.objects.get(prod_no=order_product.prod_no)
+        else:
+            prod = order_product.prod_no
     case_num = order_product.prod_quantity / (
         prod.prod_outer_quantity * prod.prod_inner_quantity
     )
@@ -73,8 +386,8 @@ def check_product_rule(order_product: OrderProdSchema) -> List[dict]:
         )
         return error_list
 
-    rules = get_rule(prod, OrderRuleTypeChoices.Product)
-    if rules.exists():
+    rules = get_rule(prod, OrderRuleTypeChoices.Product, snapshot)
+    if rules:
         obj_type = prod.__class__.__name__
         group_obj = prod
         if len(rules) > 1:
@@ -83,7 +396,7 @@ def check_product_rule(order_product: OrderProdSchema) -> List[dict]:
                 % {"obj_type": obj_type, "obj": group_obj}
             )
             return error_list
-        rule = rules.first()
+        rule = rules[0]
         logger.debug(f"find a rule for product {prod}:\n{rule}")
         obj_type_name = OrderRuleTypeChoices(rule.or_type).label
         if rule.or_cannot_order:
@@ -150,6 +463,82 @@ def check_product_rule(order_product: OrderProdSchema) -> List[dict]:
     return error_list
 
 
+def check_product_rules_vectorized(
+    order_products: List[Tuple[OrderProdSchema, Prod]],
+    snapshot: Optional[RuleSnapshot] = None,
+) -> Dict[int, List[dict]]:
+    """
+    Evaluate the product rules of many order lines with array operations.
+
+    Only the lines that fail a rule are handed to ``check_product_rule`` to build
+    their error messages, so the result is the same as checking line by line.
+    """
+    if snapshot is None:
+        snapshot = get_rule_snapshot()
+    n = len(order_products)
+    quantity = np.fromiter(
+        (order_product.prod_quantity for order_product, prod in order_products),
+        dtype=np.int64,
+        count=n,
+    )
+    cost_price = np.fromiter(
+        (prod.prod_cost_price for order_product, prod in order_products),
+        dtype=np.float64,
+        count=n,
+    )
+    case_size = np.fromiter(
+        (
+            prod.prod_outer_quantity * prod.prod_inner_quantity
+            for order_product, prod in order_products
+        ),
+        dtype=np.int64,
+        count=n,
+    )
+
+    cannot_order = np.zeros(n, dtype=bool)
+    shipped_as_case = np.zeros(n, dtype=bool)
+    min_order_price = np.full(n, np.nan)
+    min_cases_quantity = np.full(n, np.nan)
+    # lines left to the per-line path (multiple rules, empty case size)
+    per_line = case_size == 0
+    for i, (order_product, prod) in enumerate(order_products):
+        rules = get_rule(prod, OrderRuleTypeChoices.Product, snapshot)
+        if not rules:
+            continue
+        if len(rules) > 1:
+            per_line[i] = True
+            continue
+        rule = rules[0]
+        cannot_order[i] = rule.or_cannot_order
+        shipped_as_case[i] = rule.or_shipped_as_case
+        if rule.or_order_price is not None:
+            min_order_price[i] = rule.or_order_price
+        if rule.or_order_cases_quantity is not None:
+            min_cases_quantity[i] = rule.or_order_cases_quantity
+
+    with trace_target(OrderRuleTypeChoices.Product, "vectorized"):
+        case_size = np.where(case_size == 0, 1, case_size)
+        failed = (
+            per_line
+            | (quantity <= 0)
+            | cannot_order
+            | (shipped_as_case & (quantity % case_size != 0))
+            | (cost_price * quantity < min_order_price)
+            | (quantity / case_size < min_cases_quantity)
+        )
+
+        line_errors = dict()
+        for i in np.flatnonzero(failed):
+            order_product, prod = order_products[i]
+            error_list = check_product_rule(order_product, prod, snapshot)
+            if error_list:
+                line_errors[int(i)] = error_list
+    logger.debug(
+        f"vectorized product rule check: {len(line_errors)} failing lines in {n}"
+    )
+    return line_errors
+
+
 def group_by(prod_dict: dict, key: Literal["category", "manufacturer"]):
     grouped_prods = dict()
     for prod, prod_quantity in prod_dict.items():
@@ -207,18 +596,29 @@ def check_category_manufacturer_rule(
     return error_list
 
 
-def check_category_rule(prod_dict: dict) -> List[dict]:
-    error_list = []
-    grouped_prod_dict = group_by(prod_dict, "category")
-    for group_obj, group_prod_list in grouped_prod_dict.items():
-        rules = get_rule(group_obj, OrderRuleTypeChoices.ProductCategory)
+def group_by_category_ancestors(prod_dict: dict, snapshot: RuleSnapshot):
+    grouped_prods = dict()
+    for prod, prod_quantity in prod_dict.items():
+        for group_obj in snapshot.get_category_ancestors(prod.prod_cate_no_id):
+            grouped_prods.setdefault(group_obj, []).append((prod, prod_quantity))
+    logger.debug(f"classify by category ancestors:\n{pretty_repr(grouped_prods)}")
+    return grouped_prods
+
+
+def check_group_rule(
+    group_obj: Union[Manufacturer, ProdCategory],
+    group_prod_list: List[Tuple[Prod, int]],
+    or_type: OrderRuleTypeChoices,
+    snapshot: Optional[RuleSnapshot] = None,
+) -> List[dict]:
+    with trace_target(or_type, group_obj):
+        error_list = []
+        rules = get_rule(group_obj, or_type, snapshot)
         group_obj_name = group_obj.__class__.__name__
-        logger.debug(
-            f"query rules for {group_obj_name}<{group_obj}>: {rules if len(rules) > 0 else None}"
-        )
-        if not rules.exists():
+        logger.debug(f"query rules for {group_obj_name}<{group_obj}>: {rules or None}")
+        if not rules:
             # rule does not exist
-            continue
+            return error_list
 
         if len(rules) > 1:
             logger.warning(
@@ -236,60 +636,197 @@ def check_category_rule(prod_dict: dict) -> List[dict]:
                     "obj_type": group_obj_name,
                 }
             )
-            continue
+            return error_list
 
-        rule = rules.first()
+        rule = rules[0]
         error_list += check_category_manufacturer_rule(group_obj, group_prod_list, rule)
 
         # add more validation here
 
+        return error_list
+
+
+def iter_group_rule_errors(
+    prod_dict: dict, snapshot: Optional[RuleSnapshot] = None
+) -> Iterator[Tuple[Union[Manufacturer, ProdCategory], List[dict]]]:
+    if snapshot is None:
+        snapshot = get_rule_snapshot()
+    grouped_prod_dict = group_by_category_ancestors(prod_dict, snapshot)
+    for group_obj, group_prod_list in grouped_prod_dict.items():
+        yield group_obj, check_group_rule(
+            group_obj, group_prod_list, OrderRuleTypeChoices.ProductCategory, snapshot
+        )
+    grouped_prod_dict = group_by(prod_dict, "manufacturer")
+    for group_obj, group_prod_list in grouped_prod_dict.items():
+        yield group_obj, check_group_rule(
+            group_obj, group_prod_list, OrderRuleTypeChoices.Manufacturer, snapshot
+        )
+
+
+def check_category_rule(
+    prod_dict: dict, snapshot: Optional[RuleSnapshot] = None
+) -> List[dict]:
+    if snapshot is None:
+        snapshot = get_rule_snapshot()
+    error_list = []
+    grouped_prod_dict = group_by_category_ancestors(prod_dict, snapshot)
+    for group_obj, group_prod_list in grouped_prod_dict.items():
+        error_list += check_group_rule(
+            group_obj, group_prod_list, OrderRuleTypeChoices.ProductCategory, snapshot
+        )
     return error_list
 
 
-def check_manufacturer_rule(prod_dict: dict) -> List[dict]:
+def check_manufacturer_rule(
+    prod_dict: dict, snapshot: Optional[RuleSnapshot] = None
+) -> List[dict]:
+    if snapshot is None:
+        snapshot = get_rule_snapshot()
     error_list = []
     grouped_prod_dict = group_by(prod_dict, "manufacturer")
     for group_obj, group_prod_list in grouped_prod_dict.items():
-        rules = get_rule(group_obj, OrderRuleTypeChoices.Manufacturer)
-        group_obj_name = group_obj.__class__.__name__
-        logger.debug(
-            f"query rules for {group_obj_name}<{group_obj}>: {rules if len(rules) > 0 else None}"
+        error_list += check_group_rule(
+            group_obj, group_prod_list, OrderRuleTypeChoices.Manufacturer, snapshot
         )
-        if not rules.exists():
-            # rule does not exist
-            continue
+    return error_list
 
-        if len(rules) > 1:
-            logger.warning(
-                "找到多個%(obj_type)s %(obj)s的規則"
-                % {"obj_type": group_obj_name, "obj": group_obj}
-            )
-            error_list.append(
-                {
-                    "code": "multiple_rules",
-                    "message": _(
-                        "找到多個%(obj_type)s %(obj)s的規則"
-                        % {"obj_type": group_obj_name, "obj": group_obj}
-                    ),
-                    "obj": str(group_obj),
-                    "obj_type": group_obj_name,
-                }
-            )
-            continue
 
-        rule = rules.first()
-        error_list += check_category_manufacturer_rule(group_obj, group_prod_list, rule)
+def get_checklist(user, mfr_full_id: str) -> Dict[int, int]:
+    """The checked products of a user for a manufacturer, prod_no -> quantity."""
+    return dict(
+        Checklist.objects.filter(
+            cl_user_id=user, cl_mfr_full_id=mfr_full_id
+        ).values_list("cl_prod_no", "cl_order_quantity")
+    )
 
-        # add more validation here
 
-    return error_list
+def apply_checklist_changes(
+    user, mfr_full_id: str, checked: Dict[int, int], unchecked: List[int]
+):
+    """
+    Apply checkbox changes to a user's checklist of a manufacturer in place.
+
+    Checked products are upserted with their quantity and unchecked ones are
+    deleted, so an update only touches the changed lines.
+    """
+    with transaction.atomic():
+        if unchecked:
+            Checklist.objects.filter(
+                cl_user_id=user, cl_mfr_full_id=mfr_full_id, cl_prod_no__in=unchecked
+            ).delete()
+        if checked:
+            Checklist.objects.bulk_create(
+                [
+                    Checklist(
+                        cl_user_id=user,
+                        cl_mfr_full_id=mfr_full_id,
+                        cl_prod_no_id=prod_no,
+                        cl_order_quantity=order_quantity,
+                    )
+                    for prod_no, order_quantity in checked.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["cl_user_id", "cl_mfr_full_id", "cl_prod_no"],
+                update_fields=["cl_order_quantity"],
+            )
 
 
-def get_order_no_from_day(day=timezone.localdate()):
-    # TODO: order and timezone.now().date() didn't not sync,
-    #       if user enter the order create page at 23:59:59,
-    #       and then create an order at 00:00:00 (the form failed, and the user re-enter the form),
-    #       the od_date will update, but the od_no didn't.
+def get_checklists(user, mfr_full_ids: List[str]) -> Dict[str, Dict[int, int]]:
+    """The checklists of a user for several manufacturers, read in one query."""
+    checklists = {mfr_full_id: dict() for mfr_full_id in mfr_full_ids}
+    for mfr_full_id, prod_no, order_quantity in Checklist.objects.filter(
+        cl_user_id=user, cl_mfr_full_id__in=mfr_full_ids
+    ).values_list("cl_mfr_full_id", "cl_prod_no", "cl_order_quantity"):
+        checklists[mfr_full_id][prod_no] = order_quantity
+    return checklists
+
+
+def get_circulated_order_products(
+    buyer, cursor: Optional[Tuple[int, int]] = None
+) -> QuerySet:
+    """
+    Products of every manufacturer of a buyer, grouped by manufacturer.
+
+    The products are ordered by (manufacturer, product) and the cursor is the
+    last pair of the previous page, so each page is one indexed range query
+    whatever the number of manufacturers.
+    """
+    products = (
+        Prod.objects.filter(prod_mfr_id__mfr_user_id=buyer)
+        .select_related("prod_mfr_id", "suggestion")
+        .order_by("prod_mfr_id", "prod_no")
+    )
+    if cursor is not None:
+        mfr_id, prod_no = cursor
+        products = products.filter(
+            Q(prod_mfr_id__gt=mfr_id) | Q(prod_mfr_id=mfr_id, prod_no__gt=prod_no)
+        )
+    return products
+
+
+def get_circulated_order_page(
+    buyer, cursor: Optional[str] = None, limit: int = 100
+) -> Tuple[List[Prod], Optional[str]]:
+    """
+    A page of ``get_circulated_order_products`` and the cursor of the next one.
+
+    Cursors are ``"<mfr_id>-<prod_no>"`` strings, a malformed cursor raises
+    ValueError.
+    """
+    if cursor is not None:
+        mfr_id, prod_no = cursor.split("-")
+        cursor = (int(mfr_id), int(prod_no))
+    # one extra row tells whether there is a next page
+    products = list(get_circulated_order_products(buyer, cursor)[: limit + 1])
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = f"{products[-1].prod_mfr_id_id}-{products[-1].prod_no}"
+    return products, next_cursor
+
+
+def get_checklist_totals(user, mfr_full_id: str) -> Dict[str, float]:
+    """
+    Totals of a manufacturer's products against a user's checklist.
+
+    The products are joined to the checklist and summed in one aggregate
+    query: the ordered cases, the order cost and the stock after ordering.
+    Products not in the checklist count as not ordered.
+    """
+    ordered = Coalesce(F("checked__cl_order_quantity"), 0)
+    totals = (
+        Prod.objects.filter(prod_mfr_id__mfr_full_id=mfr_full_id)
+        .annotate(
+            checked=FilteredRelation(
+                "checklist",
+                condition=Q(
+                    checklist__cl_user_id=user,
+                    checklist__cl_mfr_full_id=mfr_full_id,
+                ),
+            )
+        )
+        .aggregate(
+            order_box_quantity=Sum(
+                ordered
+                * 1.0
+                / NullIf(F("prod_outer_quantity") * F("prod_inner_quantity"), 0),
+                output_field=FloatField(),
+            ),
+            order_cost_price=Sum(
+                ordered * F("prod_cost_price"), output_field=FloatField()
+            ),
+            total_quantity=Sum(F("prod_quantity") + ordered),
+        )
+    )
+    return {
+        "order_box_quantity": round(totals["order_box_quantity"] or 0, 2),
+        "order_cost_price": round(totals["order_cost_price"] or 0, 2),
+        "total_quantity": totals["total_quantity"] or 0,
+    }
+
+
+def get_order_no_base(day: date) -> int:
+    """The order number before the first order of ``day``, YYYY(mm+30)dd00000."""
     day_str = day.strftime("%Y%m%d")
 
     # Month + 30
@@ -298,28 +835,173 @@ def get_order_no_from_day(day=timezone.localdate()):
     day_str_list = list(day_str)
     day_str_list[4] = str(int(day_str[4]) + 3)
     day_str = "".join(day_str_list)
-
-    orders = Order.objects.filter(od_no__startswith=day_str)
-
-    if orders.exists():
-        order_no = orders.last().od_no
-    else:
-        order_no = int(day_str + "00000")
-    return order_no
-
-
-def get_rule(
-    or_item: Union[Prod, ProdCategory, Manufacturer], or_type: OrderRuleTypeChoices
-):
-    rules = OrderRule.objects.filter(
-        or_type=or_type,
-        or_effective_start_date__lte=timezone.now(),
-        or_effective_end_date__gte=timezone.now(),
+    return int(day_str + "00000")
+
+
+def get_order_no_prefix_range(prefix: str) -> Tuple[int, int]:
+    """
+    The order numbers starting with ``prefix``, as a range of the primary key.
+
+    Order numbers all have ``ORDER_NO_DIGITS`` digits, so a prefix is a range
+    scan of the key instead of a cast of every number to text. A prefix that
+    is not a number matches nothing.
+    """
+    prefix = prefix.strip()
+    if not prefix.isdigit() or len(prefix) > ORDER_NO_DIGITS:
+        return (0, -1)
+    scale = 10 ** (ORDER_NO_DIGITS - len(prefix))
+    return (int(prefix) * scale, (int(prefix) + 1) * scale - 1)
+
+
+def reserve_order_nos(count: int = 1, day: Optional[date] = None) -> range:
+    """
+    Reserve ``count`` consecutive order numbers of ``day`` (today by default).
+
+    The day's sequence row is bumped with a single ``UPDATE ... RETURNING``, so
+    concurrent callers always get disjoint blocks. The row is created on the
+    first reservation of the day, continuing after the orders numbered before
+    the sequence existed.
+    """
+    if day is None:
+        day = timezone.localdate()
+    base = get_order_no_base(day)
+    table = connection.ops.quote_name(OrderNoSequence._meta.db_table)
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET ons_last_no = ons_last_no + %s "
+                f"WHERE ons_day = %s RETURNING ons_last_no",
+                [count, day],
+            )
+            row = cursor.fetchone()
+        if row is not None:
+            last_no = row[0]
+            break
+        last_od_no = Order.objects.filter(
+            od_no__gt=base, od_no__lt=base + 100000
+        ).aggregate(Max("od_no"))["od_no__max"]
+        last_no = (last_od_no - base if last_od_no else 0) + count
+        try:
+            with transaction.atomic():
+                OrderNoSequence.objects.create(ons_day=day, ons_last_no=last_no)
+            break
+        except IntegrityError:
+            # another request created the row first, reserve from it
+            continue
+    return range(base + last_no - count + 1, base + last_no + 1)
+
+
+def peek_order_nos(count: int = 1, day: Optional[date] = None) -> range:
+    """
+    The order numbers ``reserve_order_nos`` would hand out next, for display.
+
+    Nothing is reserved, the numbers may be taken by another request before
+    the caller reserves its own.
+    """
+    if day is None:
+        day = timezone.localdate()
+    base = get_order_no_base(day)
+    last_no = (
+        OrderNoSequence.objects.filter(ons_day=day)
+        .values_list("ons_last_no", flat=True)
+        .first()
+    )
+    if last_no is None:
+        last_od_no = Order.objects.filter(
+            od_no__gt=base, od_no__lt=base + 100000
+        ).aggregate(Max("od_no"))["od_no__max"]
+        last_no = last_od_no - base if last_od_no else 0
+    return range(base + last_no + 1, base + last_no + count + 1)
+
+
+def create_orders(
+    mfr_prod_dict: dict, max_products: Optional[int] = None
+) -> List[Order]:
+    """
+    Create the orders of validated lines grouped by manufacturer.
+
+    The lines of a manufacturer are split into orders of at most
+    ``max_products`` lines (``config.ORDER_MAX_PRODUCTS`` by default, 0 for no
+    limit). The order numbers are reserved in one block and the orders and
+    their lines are written with ``bulk_create`` in a single transaction.
+    """
+    if max_products is None:
+        max_products = config.ORDER_MAX_PRODUCTS
+    order_lines = []
+    for mfr, prods in mfr_prod_dict.items():
+        size = max_products or len(prods)
+        for start in range(0, len(prods), size):
+            order_lines.append((mfr, prods[start : start + size]))
+
+    now = timezone.now()
+    except_arrival_date = timezone.localdate(now) + timezone.timedelta(days=7)
+    with transaction.atomic():
+        od_nos = reserve_order_nos(len(order_lines), timezone.localdate(now))
+        orders = Order.objects.bulk_create(
+            Order(
+                od_no=od_no,
+                od_mfr_id=mfr,
+                od_date=now,
+                od_except_arrival_date=except_arrival_date,
+            )
+            for od_no, (mfr, _prods) in zip(od_nos, order_lines)
+        )
+        OrderProd.objects.bulk_create(
+            OrderProd(op_od_no=order, op_prod_no=prod, op_quantity=order_quantity)
+            for order, (_mfr, prods) in zip(orders, order_lines)
+            for prod, order_quantity in prods
+        )
+        # bulk writes skip the signals, the search rows are written here
+        refresh_order_search([order.od_no for order in orders])
+    return orders
+
+
+def refresh_order_search(od_nos: List[int]) -> None:
+    """
+    Rewrite the ``OrderSearch`` rows of some orders from the orders.
+
+    The orders are read in one query and the rows are upserted in one statement
+    per batch, orders that no longer exist are left to the cascade. Lines are
+    not copied, the product filter reads them through the unique order line
+    index.
+    """
+    rows = [
+        OrderSearch(
+            os_od_no_id=od_no,
+            os_user_id_id=user_id,
+            os_mfr_id_id=mfr_id,
+            os_date=od_date,
+            os_except_arrival_date=except_arrival_date,
+            os_notes="\n".join(filter(None, [notes, contact_form_notes])),
+        )
+        for (
+            od_no,
+            user_id,
+            mfr_id,
+            od_date,
+            except_arrival_date,
+            notes,
+            contact_form_notes,
+        ) in Order.objects.filter(od_no__in=od_nos).values_list(
+            "od_no",
+            "od_mfr_id__mfr_user_id",
+            "od_mfr_id",
+            "od_date",
+            "od_except_arrival_date",
+            "od_notes",
+            "od_contact_form_notes",
+        )
+    ]
+    OrderSearch.objects.bulk_create(
+        rows,
+        batch_size=ORDER_SEARCH_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["os_od_no"],
+        update_fields=[
+            "os_user_id",
+            "os_mfr_id",
+            "os_date",
+            "os_except_arrival_date",
+            "os_notes",
+        ],
     )
-    if or_type == OrderRuleTypeChoices.Product:
-        rules = rules.filter(or_prod_no=or_item.pk)
-    elif or_type == OrderRuleTypeChoices.ProductCategory:
-        rules = rules.filter(or_prod_cate_no=or_item.pk)
-    elif or_type == OrderRuleTypeChoices.Manufacturer:
-        rules = rules.filter(or_mfr_id=or_item.pk)
-    return rules
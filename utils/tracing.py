@@ -0,0 +1,135 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+@dataclass
+class RuleTrace:
+    or_type: int
+    target: str
+    lookups: int = 0
+    lookup_time: float = 0.0
+    queries: int = 0
+    matched: int = 0
+    evaluation_time: float = 0.0
+
+
+class ValidationTrace:
+    """
+    Timings of one order validation, by rule type and target.
+
+    While a trace is active (see ``activate``) every query on the default
+    connection is counted, ``get_rule`` reports its lookups through ``lookup``
+    and the rule checks wrap the evaluation of each target in ``target``.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.total_time = 0.0
+        self.rules: Dict[Tuple[int, str], RuleTrace] = dict()
+        self._spans: List[list] = []
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def _get(self, or_type, obj) -> RuleTrace:
+        key = (int(or_type), str(obj))
+        if key not in self.rules:
+            self.rules[key] = RuleTrace(or_type=key[0], target=key[1])
+        return self.rules[key]
+
+    @contextmanager
+    def activate(self):
+        token = current_trace.set(self)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(self._count_query):
+                yield self
+        finally:
+            self.total_time += time.perf_counter() - start
+            current_trace.reset(token)
+            send_metrics(self)
+
+    @contextmanager
+    def target(self, or_type, obj):
+        # [lookup time, lookup queries] spent by get_rule inside this span
+        span = [0.0, 0]
+        self._spans.append(span)
+        start, queries = time.perf_counter(), self.queries
+        try:
+            yield
+        finally:
+            self._spans.pop()
+            rule_trace = self._get(or_type, obj)
+            rule_trace.evaluation_time += time.perf_counter() - start - span[0]
+            rule_trace.queries += self.queries - queries - span[1]
+
+    @contextmanager
+    def lookup(self, or_type, obj):
+        rule_trace = self._get(or_type, obj)
+        start, queries = time.perf_counter(), self.queries
+        try:
+            yield rule_trace
+        finally:
+            elapsed, lookup_queries = (
+                time.perf_counter() - start,
+                self.queries - queries,
+            )
+            rule_trace.lookups += 1
+            rule_trace.lookup_time += elapsed
+            rule_trace.queries += lookup_queries
+            if self._spans:
+                self._spans[-1][0] += elapsed
+                self._spans[-1][1] += lookup_queries
+
+    def as_dict(self) -> dict:
+        return {
+            "queries": self.queries,
+            "total_time": self.total_time,
+            "rules": [asdict(rule_trace) for rule_trace in self.rules.values()],
+        }
+
+
+@contextmanager
+def trace_target(or_type, obj):
+    trace: Optional[ValidationTrace] = current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.target(or_type, obj):
+        yield
+
+
+def log_metrics(metrics: dict):
+    logger.info(
+        "order validation: %(queries)s queries in %(total_time).4fs, %(rules)s targets"
+        % {**metrics, "rules": len(metrics["rules"])}
+    )
+    for rule_trace in sorted(
+        metrics["rules"],
+        key=lambda r: r["lookup_time"] + r["evaluation_time"],
+        reverse=True,
+    )[:10]:
+        logger.debug(rule_trace)
+
+
+def send_metrics(trace: ValidationTrace):
+    sink = getattr(settings, "ORDER_VALIDATION_METRICS_SINK", None)
+    if not sink:
+        return
+    try:
+        import_string(sink)(trace.as_dict())
+    except Exception:
+        logger.exception("failed to send order validation metrics to %s" % sink)